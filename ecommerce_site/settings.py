@@ -25,7 +25,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'django-insecure-quu#vv)v8m_w7w4bjq!468m5%eson=ajonl9kcfz1g1g9ie3k&'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DJANGO_DEBUG', 'true').lower() in ('1', 'true', 'yes')
 
 ALLOWED_HOSTS = ['*']
 
@@ -44,6 +44,8 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'shop.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -58,7 +60,8 @@ ROOT_URLCONF = 'ecommerce_site.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates plus render timing for RequestMetricsMiddleware
+        'BACKEND': 'shop.middleware.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],  # Add this line
         'APP_DIRS': True,
         'OPTIONS': {
@@ -67,24 +70,88 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'shop.context_processors.cart_summary',
             ],
         },
     },
 ]
 
+if not DEBUG:
+    # Compile each template once per process. Django turns this on by itself
+    # too, but the catalog leans on it, so don't leave it to a default.
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
 WSGI_APPLICATION = 'ecommerce_site.wsgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Run on every new SQLite connection. The database itself is switched to WAL
+# once, by migration shop 0015; synchronous=NORMAL is safe under WAL and
+# skips an fsync per commit; mmap and a 64 MB page cache keep the catalog in
+# memory.
+SQLITE_PRAGMAS = (
+    'PRAGMA synchronous=NORMAL;'
+    'PRAGMA mmap_size=268435456;'
+    'PRAGMA cache_size=-65536;'
+    'PRAGMA temp_store=MEMORY;'
+)
+
+# Keep connections open across requests (checked before reuse). Under ASGI
+# every request runs its sync database work in a fresh thread, so set
+# DB_CONN_MAX_AGE=0 there rather than leaving one idle connection per thread.
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 600))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': SQLITE_PRAGMAS,
+            # Seconds to wait for the write lock instead of failing with
+            # "database is locked"
+            'timeout': 20,
+            # Take the write lock when a transaction starts, so two writers
+            # never deadlock upgrading read locks (which no timeout can fix)
+            'transaction_mode': 'IMMEDIATE',
+        },
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        # A file (not the default shared in-memory database) so tests can
+        # exercise concurrent writers the way production sees them
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Optional read-only connection for catalog pages (see shop.routers). Set
+# CATALOG_READ_DATABASE to the database file (or a replica of it) to enable.
+if os.environ.get('CATALOG_READ_DATABASE'):
+    DATABASES['catalog_read'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'file:{}?mode=ro'.format(os.environ['CATALOG_READ_DATABASE']),
+        'OPTIONS': {
+            'uri': True,
+            'init_command': 'PRAGMA query_only=ON; PRAGMA mmap_size=268435456; PRAGMA cache_size=-65536;',
+            'timeout': 20,
+        },
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    }
+
+DATABASE_ROUTERS = ['shop.routers.CatalogReadRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -104,6 +171,23 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Loads the user with their profile and caches both (see shop.auth)
+AUTHENTICATION_BACKENDS = ['shop.auth.ProfileBackend']
+
+# Seconds a logged-in user's row and profile are served from the cache
+AUTH_USER_CACHE_TIMEOUT = 60 * 5
+
+# Sessions are read from the cache and written through to the database
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# (burst size, seconds to regain one attempt) for each rate limit (see shop.throttle).
+# Checked before any password hashing, so a credential-stuffing burst can't
+# tie up every worker.
+THROTTLE_RATES = {
+    'login-ip': (20, 6),
+    'login-username': (5, 30),
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -126,3 +210,54 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Worker processes the bulk image commands (import_products,
+# process_product_images) resize images in
+IMAGE_PROCESSING_WORKERS = int(os.environ.get('IMAGE_PROCESSING_WORKERS', 2))
+
+# Jobs `manage.py run_worker` runs at once (see shop.jobs)
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+
+# Order and return notifications are printed unless a real backend is set
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'LazyShops <noreply@lazyshops.local>')
+
+
+# File-based so every worker process on the host shares cached pages and
+# cart summaries, and invalidation in one worker is seen by all of them
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('DJANGO_CACHE_DIR', os.path.join(BASE_DIR, '.cache')),
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+# Lock files that serialize cache updates across the worker processes on
+# this host (see shop.locks)
+LOCK_DIR = CACHES['default']['LOCATION']
+
+# Runs the suite against its own in-memory cache (see shop.test_runner)
+TEST_RUNNER = 'shop.test_runner.IsolatedCacheTestRunner'
+
+# How long a rendered catalog/product page is served to logged-out visitors
+ANONYMOUS_PAGE_CACHE_TIMEOUT = 60 * 10
+
+# How long facet counts for one catalog query are kept (see shop.facets)
+CATALOG_FACET_CACHE_TIMEOUT = 60 * 10
+
+# How long a rendered product card/row is kept (see shop.templatetags.product_tags)
+PRODUCT_FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Seconds cart items keep their stock reserved (see shop.inventory)
+STOCK_HOLD_TTL = 60 * 15
+
+# "Frequently bought together" products kept per product (see shop.recommendations)
+RECOMMENDATIONS_PER_PRODUCT = 8
+
+# Seconds between the worker's incremental recommendation updates, which
+# bring new orders into the product pages
+RECOMMENDATIONS_REFRESH_INTERVAL = 60 * 15
+
+# Bearer token that lets a Prometheus scraper read /metrics without a staff login
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
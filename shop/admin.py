@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Product, CartItem, Order, OrderItem, Profile, ReturnRequest, ProductImage
+from django.utils import timezone
+from .models import Product, CartItem, Order, OrderItem, Profile, ReturnRequest, ProductImage, SellerStats, StockHold, StockMovement, Job
 
 @admin.register(ProductImage)
 class ProductImageAdmin(admin.ModelAdmin):
@@ -36,3 +37,30 @@ class ReturnRequestAdmin(admin.ModelAdmin):
     list_display = ['order', 'status', 'created_at']
     list_filter = ['status', 'created_at']
     search_fields = ['order__id', 'reason']
+
+@admin.register(SellerStats)
+class SellerStatsAdmin(admin.ModelAdmin):
+    list_display = ['seller', 'total_sales', 'total_orders', 'total_refunded', 'total_products', 'updated_at']
+    search_fields = ['seller__username']
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'status', 'attempts', 'run_at', 'created_at', 'finished_at']
+    list_filter = ['status', 'name']
+    search_fields = ['idempotency_key', 'last_error']
+    actions = ['retry_jobs']
+
+    @admin.action(description='Retry selected jobs now')
+    def retry_jobs(self, request, queryset):
+        queryset.exclude(status=Job.RUNNING).update(status=Job.QUEUED, attempts=0, run_at=timezone.now(), finished_at=None)
+
+@admin.register(StockHold)
+class StockHoldAdmin(admin.ModelAdmin):
+    list_display = ['product', 'user', 'quantity', 'expires_at']
+    search_fields = ['user__username', 'product__name']
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ['product', 'change', 'reason', 'user', 'order', 'created_at']
+    list_filter = ['reason', 'created_at']
+    search_fields = ['product__name', 'user__username']
@@ -0,0 +1,96 @@
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.shortcuts import redirect
+
+
+# Request authentication
+#
+# Django's AuthenticationMiddleware loads request.user once per request
+# through the session's backend. ProfileBackend loads it together with its
+# Profile (select_related) and keeps the pair in the cache, so a logged-in
+# page costs one cache read instead of user and profile queries; shop.signals
+# drops the entry whenever either row is saved or deleted.
+
+def user_cache_key(user_id):
+    return f'auth-user:{user_id}'
+
+
+def forget_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+class ProfileBackend(ModelBackend):
+    """ModelBackend whose get_user() also loads (and caches) the profile"""
+
+    def get_user(self, user_id):
+        user = cache.get(user_cache_key(user_id))
+        if user is None:
+            user = User._default_manager.select_related('profile').filter(pk=user_id).first()
+            if user is None:
+                return None
+            cache.set(user_cache_key(user_id), user, settings.AUTH_USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        user = await cache.aget(user_cache_key(user_id))
+        if user is None:
+            user = await User._default_manager.select_related('profile').filter(pk=user_id).afirst()
+            if user is None:
+                return None
+            await cache.aset(user_cache_key(user_id), user, settings.AUTH_USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
+
+
+def get_profile(user):
+    """The user's Profile, or None (anonymous users, accounts made in the admin)"""
+    return getattr(user, 'profile', None)
+
+
+def is_seller(user):
+    profile = get_profile(user)
+    return profile is not None and profile.is_seller()
+
+
+# Role checks for views; put them under @login_required
+
+def _role_required(allowed, message, redirect_to, json):
+    def deny(request):
+        if json:
+            return JsonResponse({'status': 'error'}, status=403)
+        messages.error(request, message)
+        return redirect(redirect_to)
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                request.user = await request.auser()
+                if not allowed(request.user):
+                    return deny(request)
+                return await view(request, *args, **kwargs)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not allowed(request.user):
+                return deny(request)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def seller_required(message='Access denied! Sellers only.', redirect_to='home', json=False):
+    """Turn away anyone without a seller profile (403 JSON for `json` views)"""
+    return _role_required(is_seller, message, redirect_to, json)
+
+
+def customer_required(message, redirect_to='home'):
+    """Turn sellers away; customers (and users without a profile) get through"""
+    return _role_required(lambda user: not is_seller(user), message, redirect_to, json=False)
@@ -0,0 +1,44 @@
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import CartItem
+
+
+# Per-user cart summary (item count and subtotal), cached so the navbar
+# badge on every page does not need to query the cart. shop.signals drops
+# the entry whenever a CartItem is saved or deleted, once the transaction
+# commits (so a request running meanwhile can't cache the old summary again).
+
+CART_SUMMARY_TIMEOUT = 60 * 60
+
+
+def cart_summary_key(user_id):
+    return f'cart-summary:{user_id}'
+
+
+def get_cart_summary(user):
+    key = cart_summary_key(user.pk)
+    summary = cache.get(key)
+    if summary is None:
+        summary = CartItem.objects.filter(user=user).summary()
+        cache.set(key, summary, CART_SUMMARY_TIMEOUT)
+    return summary
+
+
+async def aget_cart_summary(user):
+    key = cart_summary_key(user.pk)
+    summary = await cache.aget(key)
+    if summary is None:
+        summary = await CartItem.objects.filter(user=user).asummary()
+        await cache.aset(key, summary, CART_SUMMARY_TIMEOUT)
+    return summary
+
+
+def invalidate_cart_summary(user_id):
+    transaction.on_commit(lambda: cache.delete(cart_summary_key(user_id)))
+
+
+def invalidate_cart_summaries(user_ids):
+    keys = [cart_summary_key(user_id) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,14 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cart import get_cart_summary
+
+
+def cart_summary(request):
+    """Expose the cached cart summary; only looked up if a template uses it"""
+    def load():
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return None
+        return get_cart_summary(user)
+
+    return {'cart_summary': SimpleLazyObject(load)}
@@ -0,0 +1,98 @@
+import csv
+from itertools import islice
+
+from django.db.models import OuterRef, Subquery
+
+from .models import ReturnRequest
+
+
+# Seller sales export
+#
+# One row per order line with its order, customer and the order's latest
+# return request. Rows come from a server-side iterator, so CSV can be
+# streamed straight to the client and Parquet written in row groups, both
+# without holding the seller's history in memory.
+
+SALES_COLUMNS = [
+    'order_id', 'order_date', 'order_status', 'customer', 'product_id', 'product_name',
+    'quantity', 'unit_price', 'line_total', 'return_status', 'refund_amount', 'refund_date',
+]
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+def sales_rows(order_lines):
+    """Yield export rows (tuples in SALES_COLUMNS order) for an OrderItem queryset"""
+    latest_return = ReturnRequest.objects.filter(order=OuterRef('order')).order_by('-created_at', '-id')
+    rows = order_lines.annotate(
+        return_status=Subquery(latest_return.values('status')[:1]),
+        refund_amount=Subquery(latest_return.values('refund_amount')[:1]),
+        refund_date=Subquery(latest_return.values('refund_date')[:1]),
+    ).order_by('order__date', 'id').values_list(
+        'order_id', 'order__date', 'order__status', 'order__customer__username', 'product_id',
+        'product__name', 'quantity', 'price', 'return_status', 'refund_amount', 'refund_date',
+    )
+    for (order_id, date, status, customer, product_id, name, quantity, price,
+         return_status, refund_amount, refund_date) in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield (order_id, date, status, customer, product_id, name, quantity, price,
+               quantity * price, return_status, refund_amount, refund_date)
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class _Echo:
+    """File-like object whose write() hands the formatted line back"""
+
+    def write(self, value):
+        return value
+
+
+def csv_chunks(rows, batch_size=500):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(SALES_COLUMNS)
+    for batch in _batches(rows, batch_size):
+        yield ''.join(
+            writer.writerow([value.isoformat() if hasattr(value, 'isoformat') else value for value in row])
+            for row in batch
+        )
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def write_parquet(rows, output, row_group_size=50_000):
+    """Write rows to `output` (a binary file) as Parquet, one row group at a time"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    timestamp = pa.timestamp('us', tz='UTC')
+    schema = pa.schema([
+        ('order_id', pa.int64()),
+        ('order_date', timestamp),
+        ('order_status', pa.string()),
+        ('customer', pa.string()),
+        ('product_id', pa.int64()),
+        ('product_name', pa.string()),
+        ('quantity', pa.int32()),
+        ('unit_price', pa.decimal128(10, 2)),
+        ('line_total', pa.decimal128(12, 2)),
+        ('return_status', pa.string()),
+        ('refund_amount', pa.decimal128(10, 2)),
+        ('refund_date', timestamp),
+    ])
+    with pq.ParquetWriter(output, schema, compression='zstd') as writer:
+        for batch in _batches(rows, row_group_size):
+            columns = zip(*batch)
+            writer.write_batch(pa.record_batch(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema,
+            ))
@@ -0,0 +1,147 @@
+import hashlib
+import json
+from decimal import Decimal, InvalidOperation
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .models import Product
+from .page_cache import catalog_version
+from .search import search_products
+
+
+# Catalog facets
+#
+# Counts for the home page filters (price bands, stock, sellers), all from a
+# single GROUP BY seller query with one conditional COUNT per bucket; the
+# price and stock totals are sums over the seller rows. Each facet ignores
+# its own filter, so shoppers see what choosing another option would give.
+# Results are cached per normalized query under the catalog page version, so
+# any catalog change (see shop.page_cache) makes the counts recompute.
+
+# (min, max, label); both bounds inclusive like the min_price/max_price filters
+PRICE_BUCKETS = [
+    (None, Decimal('499.99'), 'Under ₹500'),
+    (Decimal('500'), Decimal('999.99'), '₹500 – ₹1,000'),
+    (Decimal('1000'), Decimal('4999.99'), '₹1,000 – ₹5,000'),
+    (Decimal('5000'), Decimal('19999.99'), '₹5,000 – ₹20,000'),
+    (Decimal('20000'), None, '₹20,000 & above'),
+]
+
+SELLER_FACET_SIZE = 10
+
+
+def _price(value):
+    try:
+        price = Decimal(value.strip())
+    except (InvalidOperation, AttributeError):
+        return None
+    if not price.is_finite() or price < 0:
+        return None
+    return price.quantize(Decimal('0.01'))
+
+
+def parse_filters(params):
+    """Normalize the catalog's query parameters; anything invalid is dropped"""
+    seller = params.get('seller', '')
+    return {
+        'search': ' '.join(params.get('search', '').split()),
+        'min_price': _price(params.get('min_price', '')),
+        'max_price': _price(params.get('max_price', '')),
+        'stock': params.get('stock', '') if params.get('stock') in ('in_stock', 'out_of_stock') else '',
+        'seller': int(seller) if seller.isdigit() else None,
+    }
+
+
+def _price_q(low, high):
+    q = Q()
+    if low is not None:
+        q &= Q(price__gte=low)
+    if high is not None:
+        q &= Q(price__lte=high)
+    return q
+
+
+def _stock_q(stock):
+    return {'in_stock': Q(stock__gt=0), 'out_of_stock': Q(stock=0)}.get(stock, Q())
+
+
+def filter_q(filters, ignore=None):
+    """The price/stock/seller filters as one Q, leaving out the `ignore` facet"""
+    q = Q()
+    if ignore != 'price':
+        q &= _price_q(filters['min_price'], filters['max_price'])
+    if ignore != 'stock':
+        q &= _stock_q(filters['stock'])
+    if ignore != 'seller' and filters['seller'] is not None:
+        q &= Q(seller=filters['seller'])
+    return q
+
+
+def _facet_rows(filters):
+    products = Product.objects.all()
+    if filters['search']:
+        products = search_products(products, filters['search'])
+
+    counts = {
+        'total': Count('pk', filter=filter_q(filters, ignore='seller')),
+        'in_stock': Count('pk', filter=_stock_q('in_stock') & filter_q(filters, ignore='stock')),
+        'out_of_stock': Count('pk', filter=_stock_q('out_of_stock') & filter_q(filters, ignore='stock')),
+    }
+    for index, (low, high, _) in enumerate(PRICE_BUCKETS):
+        counts[f'price_{index}'] = Count('pk', filter=_price_q(low, high) & filter_q(filters, ignore='price'))
+    return products.order_by().values('seller', 'seller__username').annotate(**counts)
+
+
+def _summarize(rows, filters):
+    # Price and stock counts respect the seller filter; only that seller's
+    # row contributes when one is chosen
+    selected = [row for row in rows if filters['seller'] in (None, row['seller'])]
+    sellers = sorted(
+        (row for row in rows if row['total']), key=lambda row: (-row['total'], row['seller__username'])
+    )
+    return {
+        'price': [
+            {
+                'min': low,
+                'max': high,
+                'label': label,
+                'count': sum(row[f'price_{index}'] for row in selected),
+                'selected': (filters['min_price'], filters['max_price']) == (low, high),
+            }
+            for index, (low, high, label) in enumerate(PRICE_BUCKETS)
+        ],
+        'stock': {key: sum(row[key] for row in selected) for key in ('in_stock', 'out_of_stock')},
+        'sellers': [
+            {'id': row['seller'], 'username': row['seller__username'], 'count': row['total'],
+             'selected': row['seller'] == filters['seller']}
+            for row in sellers[:SELLER_FACET_SIZE]
+        ],
+    }
+
+
+def _cache_key(filters):
+    # Search is case-insensitive, so "Shoes" and "shoes" share an entry
+    normalized = json.dumps(dict(filters, search=filters['search'].lower()), sort_keys=True, default=str)
+    return f'facets:{catalog_version()}:{hashlib.md5(normalized.encode()).hexdigest()}'
+
+
+def facet_counts(filters):
+    """Facet counts for the catalog query described by `filters` (see parse_filters)"""
+    key = _cache_key(filters)
+    facets = cache.get(key)
+    if facets is None:
+        facets = _summarize(list(_facet_rows(filters)), filters)
+        cache.set(key, facets, settings.CATALOG_FACET_CACHE_TIMEOUT)
+    return facets
+
+
+async def afacet_counts(filters):
+    key = await sync_to_async(_cache_key)(filters)
+    facets = await cache.aget(key)
+    if facets is None:
+        facets = _summarize([row async for row in _facet_rows(filters)], filters)
+        await cache.aset(key, facets, settings.CATALOG_FACET_CACHE_TIMEOUT)
+    return facets
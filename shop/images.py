@@ -0,0 +1,137 @@
+import multiprocessing
+import os
+import posixpath
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+
+# Responsive image renditions
+#
+# Every uploaded product image keeps its original file and gets resized
+# copies at fixed widths in WebP and JPEG, stored next to it under
+# "renditions/". A rendition is only made when it is narrower than the
+# original, so once ProductImage.width is known the set of renditions (and
+# the srcset) can be derived without touching the disk.
+
+RENDITION_WIDTHS = (320, 640, 1024)
+RENDITION_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def rendition_name(name, width, ext):
+    """products/foo.png -> products/renditions/foo.png-640w.webp"""
+    # Storage names always use forward slashes. The original's extension is
+    # kept so foo.png and foo.jpg in one directory don't share renditions
+    directory, filename = posixpath.split(name)
+    return posixpath.join(directory, 'renditions', f'{filename}-{width}w.{ext}')
+
+
+def rendition_widths(original_width):
+    if not original_width:
+        return []
+    return [width for width in RENDITION_WIDTHS if width < original_width]
+
+
+def build_srcset(name, original_width, ext, include_original=False):
+    candidates = [
+        f'{default_storage.url(rendition_name(name, width, ext))} {width}w'
+        for width in rendition_widths(original_width)
+    ]
+    if include_original and candidates:
+        candidates.append(f'{default_storage.url(name)} {original_width}w')
+    return ', '.join(candidates)
+
+
+def responsive_image_data(name, width=None, height=None):
+    """Everything a template needs to render an <img>/<picture> for `name`"""
+    return {
+        'src': default_storage.url(name),
+        'width': width,
+        'height': height,
+        'webp_srcset': build_srcset(name, width, 'webp'),
+        'srcset': build_srcset(name, width, 'jpg', include_original=True),
+    }
+
+
+def render_renditions(media_root, name):
+    """Write every rendition of one image and return its (width, height).
+
+    Runs inside a worker process, so it only uses the filesystem and Pillow.
+    """
+    source_path = os.path.join(media_root, name)
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        width, height = image.size
+
+        for target_width in rendition_widths(width):
+            target_height = max(1, round(height * target_width / width))
+            resized = image.resize((target_width, target_height), Image.Resampling.LANCZOS)
+
+            for ext, (pil_format, options) in RENDITION_FORMATS.items():
+                output = resized
+                if pil_format == 'JPEG' and output.mode != 'RGB':
+                    output = _flatten(output)
+                elif output.mode not in ('RGB', 'RGBA'):
+                    output = output.convert('RGBA')
+                path = os.path.join(media_root, rendition_name(name, target_width, ext))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                output.save(path, pil_format, **options)
+
+    return width, height
+
+
+def import_image(media_root, source_path, name):
+    """Validate a local image file, copy it into media as `name` and render it.
+
+    Used by the import_products command; runs inside a worker process.
+    Raises if the file is missing or is not an image Pillow can decode.
+    """
+    with Image.open(source_path) as image:
+        image.verify()
+    destination = os.path.join(media_root, name)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    shutil.copyfile(source_path, destination)
+    try:
+        return render_renditions(media_root, name)
+    except Exception:
+        os.remove(destination)
+        raise
+
+
+def remove_image_files(name, width):
+    """Delete an image and all of its renditions from storage"""
+    default_storage.delete(name)
+    for target_width in rendition_widths(width):
+        for ext in RENDITION_FORMATS:
+            default_storage.delete(rendition_name(name, target_width, ext))
+
+
+def _flatten(image):
+    """JPEG has no alpha channel; paint transparent areas white"""
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn keeps the workers free of the parent's DB connections and threads
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_PROCESSING_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _executor
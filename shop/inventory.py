@@ -0,0 +1,177 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .jobs import periodic
+from .models import InsufficientStock, Product, StockHold, StockMovement
+from .page_cache import invalidate_catalog_pages, invalidate_product_pages
+
+
+# Inventory reservations
+#
+# Product.stock counts the units anyone can still buy. Putting an item in the
+# cart moves units out of it into a StockHold that lasts STOCK_HOLD_TTL
+# seconds (renewed whenever the cart line changes); checkout turns the holds
+# into the order, and removing the item or letting the hold lapse puts the
+# units back. Every change is a conditional UPDATE on the product row plus a
+# StockMovement ledger entry, written in one transaction.
+
+def _take(product_id, quantity):
+    """Remove units from stock if they are all there; returns whether it did"""
+    return bool(Product.objects.filter(pk=product_id, stock__gte=quantity).update(stock=F('stock') - quantity))
+
+
+def _put(product_id, quantity):
+    Product.objects.filter(pk=product_id).update(stock=F('stock') + quantity)
+
+
+def _stock_moved(changes):
+    """Retire cached pages after stock moved by {product id: net change}.
+
+    Only the products' own pages show the units left; listings (and the
+    facet counts) just show in or out of stock, so they're retired only for
+    products that sold out or came back. Call inside the transaction, after
+    the updates.
+    """
+    changes = {pk: change for pk, change in changes.items() if change}
+    stock = dict(Product.objects.filter(pk__in=changes).values_list('pk', 'stock'))
+    crossed = [pk for pk, change in changes.items() if pk in stock and (stock[pk] > 0) != (stock[pk] - change > 0)]
+    invalidate_product_pages(changes)
+    if crossed:
+        invalidate_catalog_pages(crossed)
+
+
+def hold_stock(user, product, quantity):
+    """Set the units of `product` held for `user`'s cart to `quantity`.
+
+    Takes or returns the difference from the current hold and restarts its
+    TTL. Raises InsufficientStock if the extra units aren't free, after
+    first reclaiming any lapsed holds on the product.
+    """
+    try:
+        return _set_hold(user, product, quantity)
+    except InsufficientStock:
+        if not expire_holds(product_ids=[product.pk]):
+            raise
+        return _set_hold(user, product, quantity)
+
+
+def release_stock(user, product):
+    hold_stock(user, product, 0)
+
+
+def _set_hold(user, product, quantity):
+    with transaction.atomic():
+        hold = StockHold.objects.filter(user=user, product=product).first()
+        change = (hold.quantity if hold else 0) - quantity
+        if change < 0:
+            if not _take(product.pk, -change):
+                raise InsufficientStock(product)
+            StockMovement.objects.create(product=product, change=change, reason='hold', user=user)
+        elif change > 0:
+            _put(product.pk, change)
+            StockMovement.objects.create(product=product, change=change, reason='release', user=user)
+
+        if quantity:
+            expires_at = timezone.now() + timedelta(seconds=settings.STOCK_HOLD_TTL)
+            StockHold.objects.update_or_create(
+                user=user, product=product, defaults={'quantity': quantity, 'expires_at': expires_at}
+            )
+        elif hold:
+            hold.delete()
+        if change:
+            # Stock moved through UPDATE, which sends no post_save signal
+            _stock_moved({product.pk: change})
+
+
+def sell_cart(order, cart_items):
+    """Take the units for an order being placed from `order.customer`'s cart.
+
+    Held units are already out of stock; the rest (the hold lapsed, or the
+    line grew past it) must still be free, or InsufficientStock is raised.
+    Call inside the checkout transaction.
+    """
+    holds = StockHold.objects.filter(user=order.customer)
+    held = dict(holds.values_list('product_id', 'quantity'))
+    movements = []
+    changes = {}
+    for item in cart_items:
+        change = held.get(item.product_id, 0) - item.quantity
+        changes[item.product_id] = change
+        if change < 0 and not _take(item.product_id, -change):
+            raise InsufficientStock(item.product)
+        if change > 0:
+            _put(item.product_id, change)
+        # Logged even when the hold covered everything, so the ledger
+        # shows which order the held units went to
+        movements.append(StockMovement(
+            product_id=item.product_id, change=min(change, 0), reason='sale', user=order.customer, order=order,
+        ))
+        if change > 0:
+            movements.append(StockMovement(
+                product_id=item.product_id, change=change, reason='release', user=order.customer, order=order,
+            ))
+    holds.filter(product__in=[item.product_id for item in cart_items]).delete()
+    StockMovement.objects.bulk_create(movements)
+    _stock_moved(changes)
+
+
+def restock_order(order, reason):
+    """Put an order's units back on sale (reason 'cancel' or 'return')"""
+    lines = list(order.items.values_list('product_id', 'quantity'))
+    with transaction.atomic():
+        for product_id, quantity in lines:
+            _put(product_id, quantity)
+        StockMovement.objects.bulk_create([
+            StockMovement(product_id=product_id, change=quantity, reason=reason, order=order)
+            for product_id, quantity in lines
+        ])
+        returned = defaultdict(int)
+        for product_id, quantity in lines:
+            returned[product_id] += quantity
+        _stock_moved(returned)
+
+
+def adjust_stock(product, change, user):
+    """Apply a seller's correction to the available stock"""
+    if not change:
+        return
+    with transaction.atomic():
+        _put(product.pk, change)
+        StockMovement.objects.create(product=product, change=change, reason='adjust', user=user)
+        _stock_moved({product.pk: change})
+
+
+@periodic(60)
+def expire_holds(product_ids=None, batch_size=500):
+    """Return the units of lapsed holds to stock; returns how many holds expired.
+
+    Works in batches, each in its own short transaction, so a backlog of
+    abandoned carts never holds the write lock for long.
+    """
+    expired = 0
+    while True:
+        with transaction.atomic():
+            holds = StockHold.objects.filter(expires_at__lte=timezone.now())
+            if product_ids is not None:
+                holds = holds.filter(product__in=product_ids)
+            batch = list(holds.order_by('expires_at').values_list('pk', 'user_id', 'product_id', 'quantity')[:batch_size])
+            if not batch:
+                return expired
+
+            returned = defaultdict(int)
+            for _, _, product_id, quantity in batch:
+                returned[product_id] += quantity
+            for product_id, quantity in returned.items():
+                _put(product_id, quantity)
+            StockMovement.objects.bulk_create([
+                StockMovement(product_id=product_id, change=quantity, reason='expire', user_id=user_id)
+                for _, user_id, product_id, quantity in batch
+            ])
+            StockHold.objects.filter(pk__in=[pk for pk, _, _, _ in batch]).delete()
+            _stock_moved(returned)
+        expired += len(batch)
@@ -0,0 +1,144 @@
+import random
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics
+from .models import Job
+
+
+# Database-backed job queue
+#
+# enqueue() writes a Job row in the caller's transaction, so workers only see
+# a job once the change that asked for it has committed, and never see it if
+# that change rolled back. `manage.py run_worker` claims due jobs, runs their
+# handlers in a thread or process pool and records the outcome; failures are
+# retried with exponential backoff until the job runs out of attempts.
+
+# How long a claimed job may run before another worker assumes it crashed
+LEASE = timedelta(minutes=10)
+# Delay before the first retry, doubling with every failed attempt
+BACKOFF_BASE = 5
+BACKOFF_MAX = 60 * 60
+
+_handlers = {}
+_periodic = []
+
+
+def register(name):
+    """Make the decorated function runnable as job `name`.
+
+    The job's payload is passed as keyword arguments, so it must be JSON.
+    """
+    def decorator(func):
+        _handlers[name] = func
+        return func
+    return decorator
+
+
+def periodic(seconds):
+    """Have run_worker call the decorated function (without arguments) every `seconds`"""
+    def decorator(func):
+        _periodic.append((seconds, func))
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, *, key=None, delay=0, max_attempts=5):
+    """Queue a job and return it.
+
+    With an idempotency `key`, enqueueing again returns the job already
+    queued under that key instead of adding another.
+    """
+    if name not in _handlers:
+        raise ValueError(f'Unknown job "{name}"')
+    fields = {
+        'name': name,
+        'payload': payload or {},
+        'max_attempts': max_attempts,
+        'run_at': timezone.now() + timedelta(seconds=delay),
+    }
+    if key is None:
+        job, created = Job.objects.create(**fields), True
+    else:
+        job, created = Job.objects.get_or_create(idempotency_key=key, defaults=fields)
+    if created:
+        metrics.jobs_enqueued.inc(job=name)
+    return job
+
+
+def claim(limit):
+    """Mark up to `limit` due jobs as running and return them"""
+    now = timezone.now()
+    # With IMMEDIATE transactions SQLite takes its write lock at the first
+    # statement, so concurrent workers claim one at a time (other databases
+    # get the same from SKIP LOCKED)
+    with transaction.atomic():
+        jobs = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status__in=[Job.QUEUED, Job.RUNNING], run_at__lte=now)
+            .order_by('run_at', 'id')[:limit]
+        )
+        if not jobs:
+            return []
+        Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status=Job.RUNNING, run_at=now + LEASE, attempts=F('attempts') + 1,
+        )
+
+    for job in jobs:
+        metrics.job_queue_delay.observe((now - job.run_at).total_seconds(), job=job.name)
+        job.status = Job.RUNNING
+        job.run_at = now + LEASE
+        job.attempts += 1
+    return jobs
+
+
+def execute(name, payload):
+    """Run one job's handler. Called in a pool thread or process."""
+    close_old_connections()
+    try:
+        _handlers[name](**payload)
+    finally:
+        close_old_connections()
+
+
+def backoff(attempts):
+    """Delay before retrying a job that has failed `attempts` times, with jitter"""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.75, 1.25))
+
+
+def finish(job, error=None, duration=0.0):
+    """Record the outcome of a claimed job's attempt and return it (done, retry or failed)"""
+    now = timezone.now()
+    # Skip the update if the lease ran out and another worker took over
+    claimed = Job.objects.filter(pk=job.pk, status=Job.RUNNING, attempts=job.attempts)
+    if error is None:
+        outcome = 'done'
+        claimed.update(status=Job.DONE, finished_at=now, last_error='')
+    elif job.attempts >= job.max_attempts:
+        outcome = 'failed'
+        claimed.update(status=Job.FAILED, finished_at=now, last_error=_describe(error))
+    else:
+        outcome = 'retry'
+        claimed.update(status=Job.QUEUED, run_at=now + backoff(job.attempts), last_error=_describe(error))
+
+    metrics.job_duration.observe(duration, job=job.name)
+    metrics.jobs_finished.inc(job=job.name, outcome=outcome)
+    return outcome
+
+
+def prune(older_than):
+    """Delete jobs that finished successfully more than `older_than` ago.
+
+    Failed jobs are kept for inspection in the admin.
+    """
+    cutoff = timezone.now() - older_than
+    deleted, _ = Job.objects.filter(status=Job.DONE, finished_at__lt=cutoff).delete()
+    return deleted
+
+
+def _describe(error):
+    return f'{type(error).__name__}: {error}'
@@ -0,0 +1,35 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: locks only hold within one process
+    fcntl = None
+
+
+# Host-wide locks
+#
+# The shared cache has no atomic read-modify-write, so code that needs one
+# (throttle buckets, the typeahead index version) holds a named lock across
+# threads (a mutex) and worker processes on this host (flock on a file in
+# LOCK_DIR) while it reads and writes.
+
+_thread_locks = {}
+
+
+@contextmanager
+def host_lock(name):
+    with _thread_locks.setdefault(name, threading.Lock()):
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(settings.LOCK_DIR, exist_ok=True)
+        with open(os.path.join(settings.LOCK_DIR, f'{name}.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,161 @@
+import json
+import statistics
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+from shop import urls
+from shop.models import CartItem, Order, OrderItem, Product, ProductImage, ReturnRequest
+
+
+# Who requests each route; anything not listed is fetched logged out
+SELLER_ROUTES = {
+    'seller_dashboard', 'seller_orders_page', 'seller_returns_page', 'seller_sales_export', 'add_product',
+    'edit_product', 'delete_product', 'update_order_status', 'handle_return_request', 'delete_product_image',
+    'reorder_product_images',
+}
+CUSTOMER_ROUTES = {
+    'cart', 'add_to_cart', 'update_cart', 'remove_from_cart', 'checkout', 'order_confirmation',
+    'order_history', 'cancel_order', 'request_return', 'update_return_tracking',
+}
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Command(BaseCommand):
+    help = 'Time every shop route through the test client and write p50/p95, query counts and sizes as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2,
+                            help='Untimed requests per route before measuring')
+        parser.add_argument('--route', action='append', default=[],
+                            help='Only benchmark this URL name (repeatable)')
+        parser.add_argument('--cold-cache', action='store_true',
+                            help='Clear the cache before every request')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1.')
+        seller, customer = self.pick_users()
+        kwargs_for = self.url_kwargs(seller, customer)
+
+        patterns = [pattern for pattern in urls.urlpatterns if isinstance(pattern, URLPattern)]
+        if options['route']:
+            patterns = [pattern for pattern in patterns if pattern.name in options['route']]
+
+        results = {}
+        for pattern in patterns:
+            names = list(pattern.pattern.converters)
+            missing = [name for name in names if name not in kwargs_for]
+            if missing:
+                raise CommandError(f'No sample value for {", ".join(missing)} (route {pattern.name})')
+            url = reverse(pattern.name, kwargs={name: kwargs_for[name] for name in names})
+
+            client = Client()
+            if pattern.name in SELLER_ROUTES:
+                client.force_login(seller)
+            elif pattern.name in CUSTOMER_ROUTES:
+                client.force_login(customer)
+
+            results[pattern.name] = self.measure(client, url, options)
+            result = results[pattern.name]
+            self.stdout.write(
+                f'{pattern.name:<26} {result["status"]}  p50 {result["p50_ms"]:8.2f} ms  '
+                f'p95 {result["p95_ms"]:8.2f} ms  {result["queries"]:3d} queries  {result["bytes"]:8d} B'
+            )
+
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'iterations': options['iterations'],
+            'cold_cache': options['cold_cache'],
+            'dataset': {
+                'products': Product.objects.count(),
+                'product_images': ProductImage.objects.count(),
+                'orders': Order.objects.count(),
+                'order_items': OrderItem.objects.count(),
+                'return_requests': ReturnRequest.objects.count(),
+            },
+            'views': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f'Wrote {options["output"]}'))
+
+    def pick_users(self):
+        """A seller with orders, and a customer with a cart who bought from them"""
+        line = (
+            OrderItem.objects.filter(
+                product__seller__profile__user_type='seller',
+                order__customer__profile__user_type='customer',
+                order__customer__cartitem__isnull=False,
+            )
+            .select_related('product__seller', 'order__customer')
+            .order_by('id').first()
+        )
+        if line is None:
+            raise CommandError('Need a seller with orders and a customer with a cart; run seed_shop first.')
+        return line.product.seller, line.order.customer
+
+    def url_kwargs(self, seller, customer):
+        order = Order.objects.filter(customer=customer, items__product__seller=seller).order_by('-date').first()
+        product = (
+            Product.objects.filter(seller=seller, images__isnull=False).order_by('id').first()
+            or Product.objects.filter(seller=seller).order_by('id').first()
+        )
+        return_request = (
+            ReturnRequest.objects.filter(order=order).first()
+            or ReturnRequest.objects.filter(order__items__product__seller=seller).order_by('id').first()
+            or ReturnRequest.objects.order_by('id').first()
+        )
+        image = ProductImage.objects.filter(product__seller=seller).order_by('id').first()
+        kwargs = {
+            'product_id': product.pk,
+            'item_id': CartItem.objects.filter(user=customer).order_by('id').first().pk,
+            'order_id': order.pk,
+        }
+        if return_request:
+            kwargs['request_id'] = return_request.pk
+        if image:
+            kwargs['image_id'] = image.pk
+        return kwargs
+
+    def measure(self, client, url, options):
+        timings = []
+        for i in range(options['warmup'] + options['iterations']):
+            if options['cold_cache']:
+                cache.clear()
+            # Several routes change data on GET (add to cart, cancel, delete...);
+            # roll every request back so each iteration sees the same database
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = client.get(url)
+                    # A streamed body (the sales export) is only built as
+                    # it's read, so that is part of the timing
+                    body = b''.join(response.streaming_content) if response.streaming else response.content
+                    elapsed = time.perf_counter() - start
+                transaction.set_rollback(True)
+            if i >= options['warmup']:
+                timings.append(elapsed * 1000)
+
+        return {
+            'url': url,
+            'status': response.status_code,
+            'p50_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(percentile(timings, 0.95), 3),
+            'mean_ms': round(statistics.fmean(timings), 3),
+            'queries': len(queries.captured_queries),
+            'bytes': len(body),
+        }
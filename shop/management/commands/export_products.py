@@ -0,0 +1,68 @@
+import csv
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Prefetch
+
+from shop.models import Product, ProductImage
+
+
+FIELDS = ['id', 'seller', 'name', 'description', 'price', 'stock', 'images', 'created_at']
+
+
+class Command(BaseCommand):
+    help = 'Stream products (optionally one seller\'s) to CSV or JSON Lines in the import_products format'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seller', help='Only export this seller\'s products')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--output', default='-', help='File to write ("-" for stdout)')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Rows fetched from the database at a time')
+
+    def handle(self, *args, **options):
+        products = (
+            Product.objects.select_related('seller')
+            .prefetch_related(Prefetch('images', queryset=ProductImage.objects.order_by('order', 'id')))
+            .order_by('id')
+        )
+        if options['seller']:
+            products = products.filter(seller__username=options['seller'])
+            if not products.exists():
+                raise CommandError(f'No products for seller "{options["seller"]}".')
+
+        stream = sys.stdout if options['output'] == '-' else open(options['output'], 'w', newline='', encoding='utf-8')
+        try:
+            write = self.writer(stream, options['format'])
+            count = 0
+            for product in products.iterator(chunk_size=options['chunk_size']):
+                write({
+                    'id': product.pk,
+                    'seller': product.seller.username,
+                    'name': product.name,
+                    'description': product.description,
+                    'price': str(product.price),
+                    'stock': product.stock,
+                    # Paths relative to MEDIA_ROOT; import with --images-dir MEDIA_ROOT
+                    'images': [image.image.name for image in product.images.all()],
+                    'created_at': product.created_at.isoformat(),
+                })
+                count += 1
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        if options['output'] != '-':
+            self.stdout.write(self.style.SUCCESS(f'Exported {count} products to {options["output"]}.'))
+
+    def writer(self, stream, fmt):
+        if fmt == 'jsonl':
+            return lambda row: stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+        writer = csv.DictWriter(stream, fieldnames=FIELDS)
+        writer.writeheader()
+
+        def write(row):
+            writer.writerow({**row, 'images': '|'.join(row['images'])})
+        return write
@@ -0,0 +1,155 @@
+import csv
+import json
+import os
+import sys
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils.crypto import get_random_string
+
+from shop.images import get_executor, import_image, remove_image_files
+from shop.models import Product, ProductImage, SellerStats
+from shop.page_cache import invalidate_catalog_pages
+from shop.search import index_products
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, row dict) without reading the whole file"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            images = row.get('images') or ''
+            row['images'] = [name.strip() for name in images.split('|') if name.strip()]
+            yield reader.line_num, row
+    else:
+        for line_no, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError as exc:
+                    yield line_no, {'_error': f'invalid JSON ({exc})'}
+
+
+def parse_row(row):
+    """Product field values for one input row; raises ValueError if unusable"""
+    if row.get('_error'):
+        raise ValueError(row['_error'])
+    name = (row.get('name') or '').strip()
+    if not name:
+        raise ValueError('name is required')
+    try:
+        price = Decimal(str(row.get('price'))).quantize(Decimal('0.01'))
+        stock = int(row.get('stock') or 0)
+        # NaN quantizes fine, but can't be compared
+        if not price.is_finite():
+            raise ValueError(price)
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError('price and stock must be numbers')
+    if price < 0 or stock < 0:
+        raise ValueError('price and stock cannot be negative')
+    images = row.get('images') or []
+    if isinstance(images, str):
+        images = [images]
+    return {'name': name, 'description': row.get('description') or '', 'price': price, 'stock': stock}, images
+
+
+class Command(BaseCommand):
+    help = 'Bulk-create products for a seller from a CSV or JSON Lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file ("-" reads stdin)')
+        parser.add_argument('--seller', required=True, help='Username of the seller who owns the products')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Input format; guessed from the file extension by default')
+        parser.add_argument('--images-dir', default='.',
+                            help='Directory that image file names in the input are relative to')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Products created per transaction')
+
+    def handle(self, *args, **options):
+        try:
+            self.seller = User.objects.get(username=options['seller'], profile__user_type='seller')
+        except User.DoesNotExist:
+            raise CommandError(f'No seller named "{options["seller"]}".')
+
+        fmt = options['format'] or ('csv' if options['path'].endswith('.csv') else 'jsonl')
+        self.images_dir = options['images_dir']
+        self.created = self.failed = 0
+
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8')
+        try:
+            batch = []
+            for line_no, row in read_rows(stream, fmt):
+                batch.append((line_no, row))
+                if len(batch) >= options['batch_size']:
+                    self.import_batch(batch)
+                    batch = []
+            self.import_batch(batch)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        style = self.style.SUCCESS if not self.failed else self.style.WARNING
+        self.stdout.write(style(f'Imported {self.created} products; skipped {self.failed} rows.'))
+
+    def import_batch(self, batch):
+        parsed = []
+        for line_no, row in batch:
+            try:
+                parsed.append((line_no, *parse_row(row)))
+            except ValueError as exc:
+                self.skip(line_no, exc)
+
+        # Decode, copy and render every image of the batch in the worker pool
+        executor = get_executor()
+        media_root = str(settings.MEDIA_ROOT)
+        jobs = []
+        for line_no, fields, images in parsed:
+            futures = []
+            for source in images:
+                stem, ext = os.path.splitext(os.path.basename(source))
+                name = f'products/{stem}_{get_random_string(7)}{ext.lower()}'
+                path = os.path.join(self.images_dir, source)
+                futures.append((name, executor.submit(import_image, media_root, path, name)))
+            jobs.append((line_no, fields, futures))
+
+        products, images = [], []
+        for line_no, fields, futures in jobs:
+            rendered, errors = [], []
+            for name, future in futures:
+                try:
+                    rendered.append((name, future.result()))
+                except Exception as exc:
+                    errors.append(exc)
+            if errors:
+                # Don't leave the product's other images behind in media
+                for name, (width, height) in rendered:
+                    remove_image_files(name, width)
+                self.skip(line_no, f'bad image ({errors[0]})')
+                continue
+            product = Product(seller=self.seller, **fields)
+            products.append(product)
+            images.append((product, rendered))
+
+        if not products:
+            return
+        with transaction.atomic():
+            Product.objects.bulk_create(products)
+            ProductImage.objects.bulk_create([
+                ProductImage(product=product, image=name, order=order, width=width, height=height)
+                for product, rendered in images
+                for order, (name, (width, height)) in enumerate(rendered)
+            ])
+            # bulk_create sends no post_save, so do what shop.signals would
+            index_products(products)
+            SellerStats.objects.filter(pk=self.seller.pk).update(total_products=F('total_products') + len(products))
+            invalidate_catalog_pages()
+        self.created += len(products)
+
+    def skip(self, line_no, reason):
+        self.failed += 1
+        self.stderr.write(f'Line {line_no}: {reason}')
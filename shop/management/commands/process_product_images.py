@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shop.images import get_executor, render_renditions
+from shop.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Generate responsive renditions for product images that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Regenerate renditions for every image, not just new ones')
+
+    def handle(self, *args, **options):
+        images = ProductImage.objects.order_by('id')
+        if not options['all']:
+            images = images.filter(width__isnull=True)
+        jobs = list(images.values_list('id', 'image'))
+
+        if not jobs:
+            self.stdout.write('All product images already have renditions.')
+            return
+
+        executor = get_executor()
+        media_root = str(settings.MEDIA_ROOT)
+        futures = [(image_id, executor.submit(render_renditions, media_root, name)) for image_id, name in jobs]
+
+        processed = 0
+        for image_id, future in futures:
+            try:
+                width, height = future.result()
+            except Exception as exc:
+                self.stderr.write(f'Image {image_id}: {exc}')
+                continue
+            ProductImage.objects.filter(pk=image_id).update(width=width, height=height)
+            processed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} of {len(jobs)} images.'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.recommendations import update_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Update the "frequently bought together" recommendations from orders placed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Recompute from every order instead of only the new ones')
+        parser.add_argument('--top', type=int,
+                            help='Recommendations kept per product (default: RECOMMENDATIONS_PER_PRODUCT)')
+
+    def handle(self, *args, **options):
+        if options['top'] is not None and options['top'] < 1:
+            raise CommandError('--top must be at least 1.')
+
+        build = update_recommendations(full=options['full'], top_k=options['top'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Folded in {build.orders} orders; updated recommendations for {build.products} products.'
+        ))
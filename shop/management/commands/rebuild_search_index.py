@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from shop.search import fts_enabled, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text product search index from the Product table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Number of products indexed per batch')
+
+    def handle(self, *args, **options):
+        if not fts_enabled():
+            self.stdout.write(self.style.WARNING(
+                'Full-text search needs SQLite FTS5; nothing to rebuild.'
+            ))
+            return
+
+        total = rebuild_index(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} products.'))
@@ -0,0 +1,26 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.models import SellerStats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the seller dashboard rollup (SellerStats) from orders and refunds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seller', action='append', default=[],
+                            help='Username to rebuild (repeatable); defaults to every seller')
+
+    def handle(self, *args, **options):
+        sellers = User.objects.filter(profile__user_type='seller')
+        if options['seller']:
+            sellers = User.objects.filter(username__in=options['seller'])
+
+        count = 0
+        for seller_id in sellers.values_list('id', flat=True).iterator():
+            with transaction.atomic():
+                SellerStats.rebuild_for(seller_id)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt stats for {count} sellers.'))
@@ -0,0 +1,137 @@
+import multiprocessing
+import signal
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import jobs
+from shop.metrics import render_metrics
+
+
+PRUNE_INTERVAL = 60 * 60
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (image renditions, notifications) until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.JOB_WORKERS,
+                            help='Jobs run at the same time')
+        parser.add_argument('--processes', action='store_true',
+                            help='Run jobs in worker processes instead of threads (better for CPU-bound work)')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once no jobs are due instead of waiting for new ones')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds between checks for new jobs while idle')
+        parser.add_argument('--keep-days', type=int, default=7,
+                            help='Delete successfully finished jobs after this many days')
+        parser.add_argument('--metrics-port', type=int,
+                            help="Serve this worker's Prometheus metrics on this port")
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        if concurrency < 1:
+            raise CommandError('--concurrency must be at least 1.')
+        if options['metrics_port']:
+            server = ThreadingHTTPServer(('', options['metrics_port']), MetricsHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        if options['processes']:
+            # spawn keeps the workers free of the parent's DB connections and threads
+            executor = ProcessPoolExecutor(
+                max_workers=concurrency,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+        else:
+            executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='job')
+
+        # Finish the jobs in hand on Ctrl-C / SIGTERM, then exit
+        self.stopping = False
+        previous_handlers = {sig: signal.signal(sig, self.stop) for sig in (signal.SIGINT, signal.SIGTERM)}
+        self.counts = {'done': 0, 'retry': 0, 'failed': 0}
+        self.verbosity = options['verbosity']
+        try:
+            self.work(executor, concurrency, options)
+        finally:
+            executor.shutdown()
+            for sig, handler in previous_handlers.items():
+                signal.signal(sig, handler)
+
+        self.stdout.write(
+            f'Ran {sum(self.counts.values())} jobs: {self.counts["done"]} done, '
+            f'{self.counts["retry"]} to retry, {self.counts["failed"]} failed.'
+        )
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def work(self, executor, concurrency, options):
+        keep = timedelta(days=options['keep_days'])
+
+        def prune_jobs():
+            jobs.prune(keep)
+
+        # Housekeeping run in this thread between jobs (see jobs.periodic)
+        periodic = [(PRUNE_INTERVAL, prune_jobs)] + jobs._periodic
+        next_run = {func: 0 for _, func in periodic}
+        in_flight = {}
+
+        while not self.stopping:
+            for interval, func in periodic:
+                if time.monotonic() >= next_run[func]:
+                    next_run[func] = time.monotonic() + interval
+                    self.run_periodic(func)
+
+            free = concurrency - len(in_flight)
+            if free:
+                for job in jobs.claim(free):
+                    future = executor.submit(jobs.execute, job.name, job.payload)
+                    in_flight[future] = (job, time.perf_counter())
+
+            if not in_flight:
+                if options['burst']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            done, _ = wait(in_flight, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+            for future in done:
+                self.finish(future, *in_flight.pop(future))
+
+        for future in wait(in_flight).done:
+            self.finish(future, *in_flight.pop(future))
+
+    def run_periodic(self, func):
+        try:
+            func()
+        except Exception as exc:
+            self.stderr.write(f'{func.__name__} failed: {exc}')
+
+    def finish(self, future, job, started):
+        error = future.exception()
+        outcome = jobs.finish(job, error, time.perf_counter() - started)
+        self.counts[outcome] += 1
+        if error is not None:
+            self.stderr.write(f'{job.name} #{job.pk} (attempt {job.attempts}/{job.max_attempts}) {outcome}: {error}')
+        elif self.verbosity > 1:
+            self.stdout.write(f'{job.name} #{job.pk} done')
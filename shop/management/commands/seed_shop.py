@@ -0,0 +1,164 @@
+import datetime
+import os
+import random
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from shop.images import render_renditions
+from shop.models import CartItem, Order, OrderItem, Product, ProductImage, Profile, ReturnRequest, SellerStats
+from shop.search import rebuild_index
+
+
+SEED_PREFIX = 'seed-'
+SEED_PASSWORD = 'password'
+
+ADJECTIVES = ['Classic', 'Wireless', 'Organic', 'Compact', 'Premium', 'Vintage', 'Smart', 'Handmade',
+              'Portable', 'Ergonomic', 'Waterproof', 'Leather', 'Ceramic', 'Bamboo', 'Steel', 'Cotton']
+NOUNS = ['Headphones', 'Mug', 'Backpack', 'Lamp', 'Keyboard', 'Notebook', 'Bottle', 'Speaker',
+         'Watch', 'Jacket', 'Chair', 'Kettle', 'Phone Case', 'Charger', 'Blanket', 'Sneakers']
+FEATURES = ['fast shipping', 'two year warranty', 'eco friendly packaging', 'gift ready',
+            'best seller', 'limited edition', 'easy returns', 'made in India']
+PALETTE = ['#6366f1', '#8b5cf6', '#ec4899', '#f59e0b', '#10b981', '#0ea5e9', '#ef4444', '#64748b']
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with a synthetic catalog, customers, carts, orders and returns for benchmarking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sellers', type=int, default=20)
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--images-per-product', type=int, default=3)
+        parser.add_argument('--customers', type=int, default=200)
+        parser.add_argument('--cart-items', type=int, default=3,
+                            help='Cart lines per customer')
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--returns', type=int, default=200)
+        parser.add_argument('--random-seed', type=int, default=1,
+                            help='Same seed, same dataset')
+        parser.add_argument('--flush', action='store_true',
+                            help='Delete previously seeded users (and everything they own) first')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['random_seed'])
+        seeded = User.objects.filter(username__startswith=SEED_PREFIX)
+        if seeded.exists():
+            if not options['flush']:
+                raise CommandError('Seed data already exists; rerun with --flush to replace it.')
+            seeded.delete()
+        if options['sellers'] < 1 or options['customers'] < 1:
+            raise CommandError('Need at least one seller and one customer.')
+
+        with transaction.atomic():
+            sellers = self.create_users('seller', options['sellers'])
+            customers = self.create_users('customer', options['customers'])
+            products = self.create_products(rng, sellers, options['products'])
+            self.create_images(rng, products, options['images_per_product'])
+            self.create_carts(rng, customers, products, options['cart_items'])
+            orders = self.create_orders(rng, customers, products, options['orders'])
+            self.create_returns(rng, orders, options['returns'])
+
+            # bulk_create skips the signals that normally maintain these
+            for seller in sellers:
+                SellerStats.rebuild_for(seller.pk)
+        rebuild_index()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(sellers)} sellers, {len(customers)} customers, {len(products)} products '
+            f'and {len(orders)} orders. Every seeded user has the password "{SEED_PASSWORD}".'
+        ))
+
+    def create_users(self, user_type, count):
+        password = make_password(SEED_PASSWORD)
+        users = User.objects.bulk_create([
+            User(username=f'{SEED_PREFIX}{user_type}-{i}', email=f'{user_type}{i}@example.com', password=password)
+            for i in range(count)
+        ])
+        Profile.objects.bulk_create([Profile(user=user, user_type=user_type) for user in users])
+        return users
+
+    def create_products(self, rng, sellers, count):
+        return Product.objects.bulk_create([
+            Product(
+                name=f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}',
+                description=f'{rng.choice(ADJECTIVES)} and {rng.choice(ADJECTIVES).lower()}, '
+                            f'with {rng.choice(FEATURES)} and {rng.choice(FEATURES)}.',
+                price=Decimal(rng.randint(99, 99999)) / 100,
+                stock=rng.choice([0, 3, 10, 25, 100]),
+                seller=rng.choice(sellers),
+            )
+            for i in range(count)
+        ], batch_size=1000)
+
+    def create_images(self, rng, products, per_product):
+        # A handful of real files shared by every product, with renditions,
+        # so pages render the same markup as for uploaded images
+        names = []
+        for i, color in enumerate(PALETTE):
+            name = f'products/seed/seed-{i}.jpg'
+            path = os.path.join(settings.MEDIA_ROOT, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            Image.new('RGB', (1200, 1200), color).save(path, 'JPEG', quality=80)
+            names.append((name, render_renditions(str(settings.MEDIA_ROOT), name)))
+
+        images = []
+        for product in products:
+            for order in range(per_product):
+                name, (width, height) = rng.choice(names)
+                images.append(ProductImage(product=product, image=name, order=order, width=width, height=height))
+        ProductImage.objects.bulk_create(images, batch_size=2000)
+
+    def create_carts(self, rng, customers, products, per_customer):
+        CartItem.objects.bulk_create([
+            CartItem(user=customer, product=product, quantity=rng.randint(1, 3))
+            for customer in customers
+            for product in rng.sample(products, min(per_customer, len(products)))
+        ], batch_size=2000)
+
+    def create_orders(self, rng, customers, products, count):
+        now = timezone.now()
+        statuses = [status for status, label in Order.STATUS_CHOICES]
+        orders, lines = [], []
+        for i in range(count):
+            picked = rng.sample(products, min(rng.randint(1, 3), len(products)))
+            quantities = [rng.randint(1, 2) for product in picked]
+            orders.append(Order(
+                customer=rng.choice(customers),
+                total_price=sum(product.price * quantity for product, quantity in zip(picked, quantities)),
+                address=f'{i} Seed Street',
+                phone='9999999999',
+                date=now - datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 365)),
+                status=rng.choice(statuses),
+            ))
+            lines.append(list(zip(picked, quantities)))
+
+        orders = Order.objects.bulk_create(orders, batch_size=1000)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=quantity, price=product.price)
+            for order, order_lines in zip(orders, lines)
+            for product, quantity in order_lines
+        ], batch_size=2000)
+        return orders
+
+    def create_returns(self, rng, orders, count):
+        delivered = [order for order in orders if order.status == 'delivered']
+        statuses = [status for status, label in ReturnRequest.RETURN_STATUS_CHOICES]
+        returns = []
+        for order in rng.sample(delivered, min(count, len(delivered))):
+            status = rng.choice(statuses)
+            refunded = status in ('refund_processing', 'refund_completed')
+            returns.append(ReturnRequest(
+                order=order,
+                reason='Not as described',
+                status=status,
+                refund_amount=order.total_price if refunded else None,
+                refund_date=timezone.now() if status == 'refund_completed' else None,
+                refund_method='Original Payment Method' if status == 'refund_completed' else None,
+            ))
+        ReturnRequest.objects.bulk_create(returns, batch_size=1000)
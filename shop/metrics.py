@@ -0,0 +1,159 @@
+import bisect
+import threading
+
+
+# In-process metrics in the Prometheus text format
+#
+# Each worker process keeps its own numbers; Prometheus scrapes every worker
+# (or sums them) the same way it would with the official client library.
+# Updates take one lock and a few additions, cheap enough for every request.
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1_000, 10_000, 50_000, 100_000, 250_000, 500_000, 1_000_000)
+
+_registry = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    body = ','.join(f'{name}="{_escape(value)}"' for name, value in pairs)
+    return '{' + body + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _render_samples(self, items):
+        for key, value in items:
+            yield f'{self.name}{_format_labels(self.labels, key)} {_format_number(value)}'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=TIME_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        counts, total = self._values.get(self._key(labels), ((), 0))
+        return sum(counts)
+
+    def _render_samples(self, items):
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, [('le', bound)])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labels, key)
+            yield f'{self.name}_sum{labels} {_format_number(float(total))}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+def render_metrics():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Request metrics, recorded by shop.middleware.RequestMetricsMiddleware
+
+request_duration = Histogram(
+    'shop_request_duration_seconds', 'Wall time spent handling a request', ['route', 'method'],
+)
+request_db_duration = Histogram(
+    'shop_request_db_seconds', 'Time spent in SQL per request', ['route'],
+)
+request_template_duration = Histogram(
+    'shop_request_template_seconds', 'Time spent rendering templates per request', ['route'],
+)
+request_queries = Histogram(
+    'shop_request_queries', 'SQL queries run per request', ['route'], buckets=QUERY_BUCKETS,
+)
+response_size = Histogram(
+    'shop_response_size_bytes', 'Size of response bodies', ['route'], buckets=SIZE_BUCKETS,
+)
+responses = Counter(
+    'shop_responses_total', 'Responses sent, by status code', ['route', 'status'],
+)
+
+
+# Login metrics, recorded by the login view
+
+login_attempts = Counter(
+    'shop_login_attempts_total', 'Login attempts by outcome (success, failure, throttled)', ['outcome'],
+)
+login_throttled = Counter(
+    'shop_login_throttled_total', 'Login attempts refused before checking the password, by limit hit', ['scope'],
+)
+
+# Background job metrics, recorded by shop.jobs (in the run_worker process)
+
+jobs_enqueued = Counter(
+    'shop_jobs_enqueued_total', 'Jobs added to the queue', ['job'],
+)
+jobs_finished = Counter(
+    'shop_jobs_finished_total', 'Job attempts by outcome (done, retry, failed)', ['job', 'outcome'],
+)
+job_duration = Histogram(
+    'shop_job_duration_seconds', 'Time spent running a job attempt', ['job'],
+)
+job_queue_delay = Histogram(
+    'shop_job_queue_delay_seconds', 'Time a job waited past its run_at before a worker claimed it', ['job'],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900),
+)
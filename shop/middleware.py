@@ -0,0 +1,127 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.template.backends.django import DjangoTemplates, Template
+
+from . import metrics
+
+
+# Per-request timing
+#
+# RequestMetricsMiddleware puts a RequestStats in a context variable for the
+# request. Every database connection runs its SQL through record_query()
+# (installed by shop.signals when the connection opens), which counts and
+# times it against the current request's stats; sync_to_async copies the
+# context into its worker threads, so queries made there under ASGI count
+# too. TimedDjangoTemplates (the template backend configured in settings)
+# adds up template rendering. The totals go out in a Server-Timing header,
+# so browser dev tools show them, and into the histograms served at /metrics.
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'template_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+_current_stats = ContextVar('request_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """execute_wrapper() for every connection; a no-op outside a request"""
+    stats = _current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats.record_query(execute, sql, params, many, context)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        stats = _current_stats.get()
+        if stats is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
+
+
+def _route(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unmatched'
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with self.measure(request) as finish:
+            response = self.get_response(request)
+        return finish(response)
+
+    async def __acall__(self, request):
+        with self.measure(request) as finish:
+            response = await self.get_response(request)
+        return finish(response)
+
+    @contextmanager
+    def measure(self, request):
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        start = time.perf_counter()
+
+        def finish(response):
+            elapsed = time.perf_counter() - start
+            self.record(request, response, stats, elapsed)
+            return response
+
+        try:
+            yield finish
+        finally:
+            _current_stats.reset(token)
+
+    def record(self, request, response, stats, elapsed):
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"',
+            f'tpl;dur={stats.template_time * 1000:.1f}',
+            f'total;dur={elapsed * 1000:.1f}',
+        ])
+
+        route = _route(request)
+        size = 0 if response.streaming else len(response.content)
+        metrics.request_duration.observe(elapsed, route=route, method=request.method)
+        metrics.request_db_duration.observe(stats.db_time, route=route)
+        metrics.request_template_duration.observe(stats.template_time, route=route)
+        metrics.request_queries.observe(stats.queries, route=route)
+        metrics.response_size.observe(size, route=route)
+        metrics.responses.inc(route=route, status=response.status_code)
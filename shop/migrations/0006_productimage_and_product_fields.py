@@ -0,0 +1,61 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_productimage_table(apps, schema_editor):
+    # shop_productimage was created by hand on existing databases before it
+    # had a migration, so only create it where it is missing.
+    ProductImage = apps.get_model('shop', 'ProductImage')
+    table = ProductImage._meta.db_table
+    if table not in schema_editor.connection.introspection.table_names():
+        schema_editor.create_model(ProductImage)
+
+
+def drop_productimage_table(apps, schema_editor):
+    ProductImage = apps.get_model('shop', 'ProductImage')
+    schema_editor.delete_model(ProductImage)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_returnrequest_refund_amount_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='name',
+            field=models.TextField(),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='seller',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='products', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='stock',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='ProductImage',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('image', models.ImageField(upload_to='products/')),
+                        ('order', models.IntegerField(default=0)),
+                        ('created_at', models.DateTimeField(auto_now_add=True)),
+                        ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='images', to='shop.product')),
+                    ],
+                    options={
+                        'ordering': ['order'],
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(create_productimage_table, drop_productimage_table),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.7 on 2026-10-17 21:37
+
+import django.db.models.deletion
+import shop.models
+from django.db import migrations, models
+
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # prefix='2 3' keeps short prefix lookups (typeahead-style) on the index
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE shop_product_fts USING fts5("
+        "name, description, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    # Weight name matches ten times higher than description matches
+    schema_editor.execute(
+        "INSERT INTO shop_product_fts (shop_product_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')"
+    )
+    schema_editor.execute(
+        "INSERT INTO shop_product_fts (rowid, name, description) "
+        "SELECT id, name, description FROM shop_product"
+    )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS shop_product_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_productimage_and_product_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchIndex',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='shop.product')),
+                ('name', models.TextField()),
+                ('description', models.TextField()),
+                ('document', shop.models.SearchDocumentField(db_column='shop_product_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'shop_product_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+
+
+def enable_wal(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # The journal mode is stored in the database file, so it only needs
+    # setting once rather than on every connection. WAL lets readers carry on
+    # while a checkout is writing.
+    schema_editor.execute('PRAGMA journal_mode=WAL')
+
+
+def disable_wal(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('PRAGMA journal_mode=DELETE')
+
+
+class Migration(migrations.Migration):
+    # SQLite can't change the journal mode inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('shop', '0014_recommendations'),
+    ]
+
+    operations = [
+        migrations.RunPython(enable_wal, disable_wal),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_sqlite_wal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='status_changes',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='returnrequest',
+            name='status_changes',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
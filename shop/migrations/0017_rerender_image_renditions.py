@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def rerender_images(apps, schema_editor):
+    # Renditions are now named after the whole original filename, so the
+    # files already on disk no longer match. Forget the processed images'
+    # sizes (pages show the plain original meanwhile) and queue them for the
+    # worker to render again; see shop.tasks.render_product_image.
+    ProductImage = apps.get_model('shop', 'ProductImage')
+    Job = apps.get_model('shop', 'Job')
+    image_ids = list(ProductImage.objects.filter(width__isnull=False).values_list('pk', flat=True))
+    ProductImage.objects.filter(pk__in=image_ids).update(width=None, height=None)
+    Job.objects.bulk_create([
+        Job(name='render_product_image', payload={'image_id': pk}, idempotency_key=f'rerender-image:{pk}')
+        for pk in image_ids
+    ], batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0016_status_changes'),
+    ]
+
+    operations = [
+        migrations.RunPython(rerender_images, migrations.RunPython.noop),
+    ]
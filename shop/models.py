@@ -1,7 +1,14 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, DecimalField, F, OuterRef, Prefetch, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.utils import timezone
+from contextlib import contextmanager
+from decimal import Decimal
 import datetime
 
+from .images import responsive_image_data
+
 # User Profile Model
 class Profile(models.Model):
     USER_TYPE_CHOICES = [
@@ -24,6 +31,34 @@ class Profile(models.Model):
     def is_customer(self):
         return self.user_type == 'customer'
 
+class ProductQuerySet(models.QuerySet):
+    def with_card_data(self):
+        """Annotate what a product card needs: image count and primary image path.
+        
+        Both come from correlated subqueries, so a whole grid of cards is
+        rendered from a single query.
+        """
+        images = ProductImage.objects.filter(product=OuterRef('pk'))
+        image_count = images.order_by().values('product').annotate(n=Count('*')).values('n')
+        primary_image = images.order_by('order', 'id')
+        return self.annotate(
+            image_count=Coalesce(Subquery(image_count), 0),
+            primary_image_path=Subquery(primary_image.values('image')[:1]),
+            primary_image_width=Subquery(primary_image.values('width')[:1]),
+            primary_image_height=Subquery(primary_image.values('height')[:1]),
+        )
+    
+    def bought_with(self, product):
+        """Products often ordered together with `product`, best first (see shop.recommendations)"""
+        return self.filter(recommended_for__product=product).order_by('recommended_for__rank')
+    
+    def with_images(self):
+        """Prefetch every image in gallery order (one extra query for all products)"""
+        return self.prefetch_related(
+            Prefetch('images', queryset=ProductImage.objects.order_by('order', 'id'))
+        )
+
+
 # Product Model
 class Product(models.Model):
     name = models.TextField()
@@ -34,17 +69,130 @@ class Product(models.Model):
     seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='products')
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = ProductQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            # Catalog sort orders; id is the keyset paginator's tie-breaker
+            models.Index(fields=['-created_at', '-id'], name='product_created_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_idx'),
+            # "In stock" filter on the default (newest first) listing
+            models.Index(fields=['-created_at', '-id'], condition=Q(stock__gt=0),
+                         name='product_in_stock_created_idx'),
+        ]
+    
     def __str__(self):
         return self.name
     
+    def _gallery_is_prefetched(self):
+        return 'images' in getattr(self, '_prefetched_objects_cache', {})
+    
     def get_primary_image(self):
         """Get the first image or fallback to main image field"""
-        first_image = self.images.first()
-        if first_image:
-            return first_image.image.url
-        elif self.image:
-            return self.image.url
+        data = self.get_primary_image_data()
+        return data['src'] if data else None
+    
+    def get_primary_image_data(self):
+        """Like get_primary_image, but with size and srcset data for responsive <img> tags"""
+        if hasattr(self, 'primary_image_path'):
+            if self.primary_image_path:
+                return responsive_image_data(
+                    self.primary_image_path, self.primary_image_width, self.primary_image_height
+                )
+        else:
+            if self._gallery_is_prefetched():
+                images = self.images.all()
+                first_image = images[0] if images else None
+            else:
+                first_image = self.images.first()
+            if first_image:
+                return first_image.get_responsive_data()
+        if self.image:
+            return responsive_image_data(self.image.name)
         return None
+    
+    def get_image_count(self):
+        if hasattr(self, 'image_count'):
+            return self.image_count
+        if self._gallery_is_prefetched():
+            return len(self.images.all())
+        return self.images.count()
+
+
+class SearchDocumentField(models.TextField):
+    """The hidden column of an FTS5 table that accepts MATCH queries"""
+
+
+@SearchDocumentField.register_lookup
+class FullTextMatch(models.Lookup):
+    lookup_name = 'match'
+    
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+# Full-text index over Product name/description (SQLite FTS5 virtual table).
+# Rows are keyed by rowid = product id and kept in sync by shop.signals.
+class ProductSearchIndex(models.Model):
+    product = models.OneToOneField(
+        Product, on_delete=models.DO_NOTHING, primary_key=True,
+        db_column='rowid', related_name='search_index'
+    )
+    name = models.TextField()
+    description = models.TextField()
+    document = SearchDocumentField(db_column='shop_product_fts')
+    rank = models.FloatField()
+    
+    class Meta:
+        managed = False
+        db_table = 'shop_product_fts'
+
+
+class EmptyCart(Exception):
+    pass
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product):
+        super().__init__(f'Not enough stock for {product}')
+        self.product = product
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_products(self):
+        """Load each item's product (join) and its images (one prefetch query)"""
+        return self.select_related('product').prefetch_related(
+            Prefetch('product__images', queryset=ProductImage.objects.order_by('order', 'id'))
+        )
+    
+    def with_holds(self):
+        """Annotate `held`: the units of each item reserved for its owner"""
+        holds = StockHold.objects.filter(user=OuterRef('user'), product=OuterRef('product'))
+        return self.annotate(held=Coalesce(Subquery(holds.values('quantity')[:1]), 0))
+    
+    def summary(self):
+        """Item count and subtotal computed in SQL"""
+        return self._quantize(self.aggregate(**self._summary_aggregates()))
+    
+    async def asummary(self):
+        return self._quantize(await self.aaggregate(**self._summary_aggregates()))
+    
+    @staticmethod
+    def _summary_aggregates():
+        return {
+            'item_count': Coalesce(Sum('quantity'), 0),
+            'subtotal': Sum(F('quantity') * F('product__price'),
+                            output_field=DecimalField(max_digits=10, decimal_places=2)),
+        }
+    
+    @staticmethod
+    def _quantize(summary):
+        # SQLite hands back unquantized decimals for expressions
+        summary['subtotal'] = (summary['subtotal'] or Decimal('0')).quantize(Decimal('0.01'))
+        return summary
 
 
 class CartItem(models.Model):
@@ -53,11 +201,24 @@ class CartItem(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     date_added = models.DateTimeField(auto_now_add=True)
     
+    objects = CartItemQuerySet.as_manager()
+    
+    class Meta:
+        constraints = [
+            # add_to_cart's update_or_create relies on one row per product
+            models.UniqueConstraint(fields=['user', 'product'], name='cartitem_user_product_uniq'),
+        ]
+    
     def __str__(self):
         return f'{self.quantity} x {self.product.name}'
     
     def get_total(self):
         return self.quantity * self.product.price
+    
+    @property
+    def available(self):
+        """Most units this customer can have: free stock plus their own hold"""
+        return self.product.stock + getattr(self, 'held', 0)
 
 class Order(models.Model):
     STATUS_CHOICES = [
@@ -74,13 +235,69 @@ class Order(models.Model):
     phone = models.CharField(max_length=20)
     date = models.DateTimeField(default=datetime.datetime.now)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Bumped with every status change a customer is told about; it keys the
+    # notification job (see shop.tasks)
+    status_changes = models.PositiveIntegerField(default=0, editable=False)
+    
+    class Meta:
+        indexes = [
+            # Order history: a customer's orders, newest first (id breaks ties
+            # for the keyset paginator, so it's part of the index too)
+            models.Index(fields=['customer', '-date', '-id'], name='order_customer_date_idx'),
+        ]
     
     def __str__(self):
         return f'Order {self.id} by {self.customer.username}'
     
     @staticmethod
     def get_orders_by_customer(customer_id):
-        return Order.objects.filter(customer=customer_id).order_by('-date')
+        return Order.objects.filter(customer=customer_id).prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('product')),
+            'return_requests',
+        ).order_by('-date')
+    
+    @staticmethod
+    def place_from_cart(customer, address, phone):
+        """Turn the customer's cart into an order in a single transaction.
+        
+        Units the customer holds (see shop.inventory) are already theirs;
+        anything beyond the hold is taken with a conditional UPDATE
+        (stock >= quantity), so two buyers racing for the last units can
+        never both succeed. Raises InsufficientStock and rolls everything
+        back if any item is short, and EmptyCart if there is nothing to order.
+        """
+        from .inventory import sell_cart
+        
+        # The write lock is taken when the transaction begins (IMMEDIATE
+        # transaction mode in settings), so concurrent checkouts queue up
+        # behind it instead of failing on a lock upgrade. The cart is read
+        # under that lock, and the total comes from the same rows as the
+        # order lines, so a cart or price change can't slip in between.
+        with transaction.atomic():
+            cart_items = list(CartItem.objects.filter(user=customer).select_related('product'))
+            if not cart_items:
+                raise EmptyCart()
+            total = sum(item.product.price * item.quantity for item in cart_items)
+            order = Order.objects.create(
+                customer=customer,
+                total_price=total,
+                address=address,
+                phone=phone
+            )
+            sell_cart(order, cart_items)
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product=item.product,
+                    quantity=item.quantity,
+                    price=item.product.price
+                )
+                for item in cart_items
+            ])
+            CartItem.objects.filter(pk__in=[item.pk for item in cart_items]).delete()
+            SellerStats.record_new_order(order)
+        
+        return order
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
@@ -88,6 +305,12 @@ class OrderItem(models.Model):
     quantity = models.IntegerField(default=1)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     
+    class Meta:
+        indexes = [
+            # Seller views join from a seller's products to their order lines
+            models.Index(fields=['product', 'order'], name='orderitem_product_order_idx'),
+        ]
+    
     def __str__(self):
         return f'{self.quantity} x {self.product.name}'
 
@@ -110,6 +333,16 @@ class ReturnRequest(models.Model):
     refund_date = models.DateTimeField(null=True, blank=True)
     refund_method = models.CharField(max_length=50, blank=True, null=True)
     tracking_number = models.CharField(max_length=100, blank=True, null=True)
+    # Bumped with every status change, like Order.status_changes
+    status_changes = models.PositiveIntegerField(default=0, editable=False)
+    
+    class Meta:
+        indexes = [
+            # Seller returns table, filtered by status, newest first
+            models.Index(fields=['status', '-created_at'], name='return_status_created_idx'),
+            # Refund lookups per order (seller stats)
+            models.Index(fields=['order', 'status'], name='return_order_status_idx'),
+        ]
     
     def __str__(self):
         return f"Return Request for Order #{self.order.id}"
@@ -133,9 +366,278 @@ class ProductImage(models.Model):
     image = models.ImageField(upload_to='products/')
     order = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Filled in once renditions have been generated (see shop.images)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
     
     class Meta:
         ordering = ['order']
+        indexes = [
+            # Gallery and primary-image lookups: a product's images in display order
+            models.Index(fields=['product', 'order', 'id'], name='productimage_gallery_idx'),
+        ]
     
     def __str__(self):
         return f"Image {self.order} for {self.product.name}"
+    
+    def get_responsive_data(self):
+        return responsive_image_data(self.image.name, self.width, self.height)
+
+
+# Seller Statistics Rollup
+class SellerStats(models.Model):
+    """Running totals for the seller dashboard header.
+    
+    Kept up to date incrementally as orders are placed, cancelled and
+    refunded, so the dashboard reads one row instead of every order line.
+    Cancelled orders count towards neither sales nor orders; orders with a
+    completed refund still count as orders but not as sales.
+    `manage.py rebuild_seller_stats` recomputes everything from scratch.
+    """
+    seller = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='seller_stats')
+    total_sales = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_orders = models.IntegerField(default=0)
+    total_refunded = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_products = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Stats for {self.seller.username}"
+    
+    @staticmethod
+    def for_seller(seller):
+        stats = SellerStats.objects.filter(pk=seller.pk).first()
+        if stats is None:
+            stats = SellerStats.rebuild_for(seller.pk)
+        return stats
+    
+    @staticmethod
+    def rebuild_for(seller_id):
+        """Recompute one seller's totals from the order tables"""
+        money = DecimalField(max_digits=12, decimal_places=2)
+        lines = OrderItem.objects.filter(product__seller=seller_id).exclude(order__status='cancelled')
+        sales = lines.exclude(order__return_requests__status='refund_completed').aggregate(
+            total=Sum(F('quantity') * F('price'), output_field=money)
+        )['total']
+        refunded = ReturnRequest.objects.filter(
+            status='refund_completed',
+            order__in=OrderItem.objects.filter(product__seller=seller_id).values('order')
+        ).aggregate(total=Sum('refund_amount'))['total']
+        
+        stats, _ = SellerStats.objects.update_or_create(
+            seller_id=seller_id,
+            defaults={
+                'total_sales': sales or 0,
+                'total_orders': lines.count(),
+                'total_refunded': refunded or 0,
+                'total_products': Product.objects.filter(seller=seller_id).count(),
+            }
+        )
+        return stats
+    
+    @staticmethod
+    def _order_lines(order):
+        """{seller_id: (sales, line count)} for one order"""
+        rows = order.items.values('product__seller').annotate(
+            sales=Sum(F('quantity') * F('price'), output_field=DecimalField(max_digits=12, decimal_places=2)),
+            lines=Count('id'),
+        )
+        return {row['product__seller']: (row['sales'] or 0, row['lines']) for row in rows}
+    
+    @staticmethod
+    def _contributions(order, lines):
+        """What `order` currently adds to each seller's totals"""
+        refunded = order.return_requests.filter(status='refund_completed').aggregate(
+            total=Sum('refund_amount')
+        )['total'] or 0
+        cancelled = order.status == 'cancelled'
+        return {
+            seller_id: {
+                'total_sales': 0 if cancelled or refunded else sales,
+                'total_orders': 0 if cancelled else count,
+                'total_refunded': refunded,
+            }
+            for seller_id, (sales, count) in lines.items()
+        }
+    
+    @staticmethod
+    def _apply(before, after):
+        for seller_id in after.keys() | before.keys():
+            old = before.get(seller_id, {})
+            new = after.get(seller_id, {})
+            delta = {
+                field: new.get(field, 0) - old.get(field, 0)
+                for field in ('total_sales', 'total_orders', 'total_refunded')
+            }
+            if not any(delta.values()):
+                continue
+            updated = SellerStats.objects.filter(pk=seller_id).update(
+                **{field: F(field) + value for field, value in delta.items()}
+            )
+            if not updated:
+                # No rollup yet; build it from scratch (this change included)
+                SellerStats.rebuild_for(seller_id)
+    
+    @staticmethod
+    def record_new_order(order):
+        lines = SellerStats._order_lines(order)
+        SellerStats._apply({}, SellerStats._contributions(order, lines))
+    
+    @staticmethod
+    @contextmanager
+    def track(order):
+        """Apply whatever the wrapped status/refund change does to the totals.
+        
+            with transaction.atomic(), SellerStats.track(order):
+                order.status = 'cancelled'
+                order.save()
+        """
+        lines = SellerStats._order_lines(order)
+        before = SellerStats._contributions(order, lines)
+        yield
+        SellerStats._apply(before, SellerStats._contributions(order, lines))
+
+
+# Inventory Reservations (see shop.inventory)
+class StockHold(models.Model):
+    """Units of a product set aside for one customer's cart until `expires_at`.
+    
+    The units are already taken out of Product.stock; checkout turns the
+    hold into the order, and an expired hold gives them back.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stock_holds')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='holds')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='stockhold_user_product_uniq'),
+        ]
+        indexes = [
+            # The sweeper's scan for lapsed holds
+            models.Index(fields=['expires_at'], name='stockhold_expires_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} held for {self.user_id}"
+
+
+class StockMovement(models.Model):
+    """Append-only ledger of every change to Product.stock"""
+    REASON_CHOICES = [
+        ('adjust', 'Seller Adjustment'),
+        ('hold', 'Cart Hold'),
+        ('release', 'Hold Released'),
+        ('expire', 'Hold Expired'),
+        ('sale', 'Sale'),
+        ('cancel', 'Order Cancelled'),
+        ('return', 'Item Returned'),
+    ]
+    
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_movements')
+    # Units added to (positive) or taken from (negative) the available stock
+    change = models.IntegerField()
+    reason = models.CharField(max_length=10, choices=REASON_CHOICES)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', '-created_at'], name='stockmovement_product_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.change:+d} {self.product_id} ({self.reason})"
+
+
+# Background Jobs
+class Job(models.Model):
+    """A unit of deferred work, run by `manage.py run_worker` (see shop.jobs).
+    
+    Queued and running jobs are both picked up once `run_at` has passed: for
+    a running job `run_at` is the end of its lease, so work abandoned by a
+    crashed worker is retried by another one.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    # Enqueueing the same key twice creates one job
+    idempotency_key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            # Workers claiming due jobs, oldest first
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+
+# Recommendations
+class ProductPair(models.Model):
+    """How many orders contained both products: one cell of the sparse
+    item-item co-occurrence matrix, stored in both directions.
+    
+    Maintained by `manage.py rebuild_recommendations` (see shop.recommendations).
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'other'], name='productpair_product_other_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id} + {self.other_id}: {self.count}"
+
+
+class ProductRecommendation(models.Model):
+    """One of a product's top "frequently bought together" products"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommended_for')
+    # 0 is the product bought together most often
+    rank = models.PositiveSmallIntegerField()
+    score = models.PositiveIntegerField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='recommendation_product_rank_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id} -> {self.recommended_id} (#{self.rank})"
+
+
+class RecommendationBuild(models.Model):
+    """A run of the recommendation update; the latest one's `last_order_id`
+    is where the next incremental update picks up"""
+    last_order_id = models.BigIntegerField()
+    orders = models.PositiveIntegerField()
+    products = models.PositiveIntegerField()
+    full = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Recommendations up to order #{self.last_order_id}"
@@ -0,0 +1,137 @@
+import hashlib
+import uuid
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import transaction
+
+
+# Full-page cache for anonymous visitors
+#
+# Rendered catalog and product pages are stored under keys that embed a
+# version token. Instead of hunting down every cached URL when the data
+# changes, shop.signals swaps the token for a fresh one and the old entries
+# simply stop being read (they age out on their own timeout). The catalog
+# version covers every listing/search page; each product also has its own
+# version, so a change that only shows on the product's own page (units in
+# stock, recommendations) leaves the listings cached.
+
+CATALOG_VERSION_KEY = 'page-version:catalog'
+
+
+def product_version_key(product_id):
+    return f'page-version:product:{product_id}'
+
+
+def _versions(keys):
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # add() so a concurrent bump isn't overwritten by our fresh token
+            cache.add(key, uuid.uuid4().hex, None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def catalog_version():
+    """The current catalog version token, for caching anything derived from listings"""
+    return _versions([CATALOG_VERSION_KEY])[0]
+
+
+def product_versions(product_ids):
+    """{product id: current version token}, for caching anything a product renders"""
+    product_ids = list(product_ids)
+    return dict(zip(product_ids, _versions([product_version_key(pk) for pk in product_ids])))
+
+
+def _bump(keys):
+    cache.set_many({key: uuid.uuid4().hex for key in keys}, None)
+
+
+def invalidate_catalog_pages(product_ids=()):
+    """Retire cached listing pages and the detail pages of `product_ids`.
+
+    For changes that show in listings: products added or removed, names,
+    prices, images, or a product selling out or coming back into stock.
+    Deferred until the current transaction commits, so a concurrent request
+    can't re-cache the page from data that is about to change.
+    """
+    keys = [CATALOG_VERSION_KEY] + [product_version_key(pk) for pk in set(product_ids)]
+    transaction.on_commit(lambda: _bump(keys))
+
+
+def invalidate_product_pages(product_ids):
+    """Retire only the detail pages (and cards) of `product_ids`, leaving
+    listings cached; for changes such as the units left in stock."""
+    keys = [product_version_key(pk) for pk in set(product_ids)]
+    if keys:
+        transaction.on_commit(lambda: _bump(keys))
+
+
+def _cacheable_request(request):
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return False
+    # Flash messages are per-visitor, so a page that shows one can't be shared
+    return not len(get_messages(request))
+
+
+def _cacheable_response(response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not response.has_header('Cache-Control')
+    )
+
+
+def anonymous_page_cache(version_keys):
+    """Cache a view's response for logged-out visitors.
+
+    `version_keys(request, *args, **kwargs)` returns the version keys the page
+    depends on; the full path (query string included) picks the entry.
+    Works on sync and async views.
+    """
+    def decorator(view):
+        def page_key(request, args, kwargs):
+            if not _cacheable_request(request):
+                return None
+            versions = _versions(version_keys(request, *args, **kwargs))
+            path_hash = hashlib.md5(request.get_full_path().encode()).hexdigest()
+            return f'page:{view.__name__}:{":".join(versions)}:{path_hash}'
+
+        def store(key, response):
+            if _cacheable_response(response):
+                cache.set(key, response, settings.ANONYMOUS_PAGE_CACHE_TIMEOUT)
+            response['X-Page-Cache'] = 'miss'
+            return response
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                # The session, messages and cache are sync APIs
+                key = await sync_to_async(page_key)(request, args, kwargs)
+                if key is None:
+                    return await view(request, *args, **kwargs)
+                response = await cache.aget(key)
+                if response is not None:
+                    response['X-Page-Cache'] = 'hit'
+                    return response
+                response = await view(request, *args, **kwargs)
+                return await sync_to_async(store)(key, response)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = page_key(request, args, kwargs)
+            if key is None:
+                return view(request, *args, **kwargs)
+            response = cache.get(key)
+            if response is not None:
+                response['X-Page-Cache'] = 'hit'
+                return response
+            return store(key, view(request, *args, **kwargs))
+        return wrapper
+    return decorator
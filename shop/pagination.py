@@ -0,0 +1,156 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+# Keyset (cursor) pagination
+#
+# Instead of OFFSET, each page remembers the sort value and id of its first
+# and last row. The next query seeks straight past that position, so page N
+# costs the same as page 1 no matter how big the catalog gets.
+#
+# A cursor that can't be used raises InvalidCursor rather than quietly
+# serving the first page, which an infinite-scroll table would append below
+# the rows it already shows.
+
+class InvalidCursor(ValueError):
+    """A malformed cursor, or one made for a different sort order"""
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, prev_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, ordering, per_page=24):
+        self.queryset = queryset
+        self.ordering = ordering
+        self.field_name = ordering.lstrip('-')
+        self.descending = ordering.startswith('-')
+        self.per_page = per_page
+        try:
+            self.field = queryset.model._meta.get_field(self.field_name)
+        except FieldDoesNotExist:
+            # Ordering on an annotation, e.g. a search rank
+            self.field = queryset.query.annotations[self.field_name].output_field
+
+    def _order_by(self, reverse=False):
+        descending = self.descending != reverse
+        prefix = '-' if descending else ''
+        return self.queryset.order_by(f'{prefix}{self.field_name}', f'{prefix}id')
+
+    def _seek(self, queryset, value, pk, reverse=False):
+        """Filter rows strictly after (value, pk) in the walk direction"""
+        lookup = 'lt' if self.descending != reverse else 'gt'
+        return queryset.filter(
+            Q(**{f'{self.field_name}__{lookup}': value})
+            | Q(**{self.field_name: value, f'id__{lookup}': pk})
+        )
+
+    def encode_cursor(self, obj, direction):
+        value = getattr(obj, self.field_name)
+        value = value.isoformat() if hasattr(value, 'isoformat') else str(value)
+        payload = json.dumps({'s': self.ordering, 'v': value, 'id': obj.pk, 'd': direction})
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Return (value, pk, direction), or None for no cursor.
+
+        Raises InvalidCursor for a malformed cursor or one from another sort.
+        """
+        if not cursor:
+            return None
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            valid = data['s'] == self.ordering and data['d'] in ('next', 'prev')
+            position = self.field.to_python(data['v']), int(data['id']), data['d']
+        except (binascii.Error, ValueError, KeyError, TypeError, ValidationError) as exc:
+            raise InvalidCursor(cursor) from exc
+        if not valid:
+            raise InvalidCursor(cursor)
+        return position
+
+    def _window(self, position):
+        """The queryset for one page (plus one row to detect more) and its direction"""
+        limit = self.per_page + 1
+        if position is None:
+            return self._order_by()[:limit], False
+        value, pk, direction = position
+        reverse = direction == 'prev'
+        return self._seek(self._order_by(reverse), value, pk, reverse)[:limit], reverse
+
+    def _make_page(self, rows, position, reverse):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if position is None:
+            has_next, has_previous = has_more, False
+        elif reverse:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, True
+
+        if not rows:
+            return None
+        return KeysetPage(
+            rows,
+            next_cursor=self.encode_cursor(rows[-1], 'next') if has_next else None,
+            prev_cursor=self.encode_cursor(rows[0], 'prev') if has_previous else None,
+        )
+
+    def page(self, cursor=None):
+        position = self.decode_cursor(cursor)
+        queryset, reverse = self._window(position)
+        page = self._make_page(list(queryset), position, reverse)
+        if page is None:
+            # Nothing left past the cursor. Going forward that's simply the
+            # end; going back, the rows before it were deleted, so the first
+            # page is what comes before
+            return self.page() if reverse else KeysetPage([])
+        return page
+
+    async def apage(self, cursor=None):
+        """page() for async views"""
+        position = self.decode_cursor(cursor)
+        queryset, reverse = self._window(position)
+        page = self._make_page([row async for row in queryset], position, reverse)
+        if page is None:
+            return await self.apage() if reverse else KeysetPage([])
+        return page
+
+
+def approximate_count(queryset, cap=1000):
+    """Count matching rows, but stop scanning after `cap` of them.
+
+    Returns (count, capped) so templates can render "1000+".
+    """
+    count = queryset.order_by()[:cap + 1].count()
+    if count > cap:
+        return cap, True
+    return count, False
+
+
+async def aapproximate_count(queryset, cap=1000):
+    count = await queryset.order_by()[:cap + 1].acount()
+    if count > cap:
+        return cap, True
+    return count, False
@@ -0,0 +1,170 @@
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+
+from .jobs import periodic
+from .models import Order, OrderItem, ProductPair, ProductRecommendation, RecommendationBuild
+from .page_cache import invalidate_product_pages
+
+
+# "Frequently bought together"
+#
+# Two products are related by how many orders contained both. The counts form
+# a sparse item-item co-occurrence matrix, built with NumPy from the order
+# lines and kept in ProductPair; each product's top neighbours are copied to
+# ProductRecommendation, so the detail page reads them with one query.
+#
+# `manage.py rebuild_recommendations` (and the worker, every
+# RECOMMENDATIONS_REFRESH_INTERVAL seconds) folds in the orders placed since
+# the last run and recomputes the top neighbours of the products they
+# touched, retiring those products' cached detail pages.
+# Cancelled orders are left out, but an order cancelled after it was folded
+# in keeps counting until the next --full rebuild.
+
+# Orders with more lines than this are skipped: the pairs grow with the
+# square of the order size, and a bulk order says little about what goes
+# together
+MAX_BASKET = 50
+# Rows per `IN (...)` lookup, well under SQLite's variable limit
+CHUNK_SIZE = 500
+
+
+def _runs(keys):
+    """Start offset and length of each run of equal values in sorted `keys`"""
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return starts, np.diff(np.r_[starts, len(keys)])
+
+
+def cooccurrence(baskets):
+    """Count how often each pair of products shares an order.
+
+    `baskets` is an (n, 2) array of distinct (order id, product id) rows
+    sorted by order. Returns (product, other, count) arrays with every
+    pair in both directions.
+    """
+    starts, sizes = _runs(baskets[:, 0])
+    row_sizes = np.repeat(sizes, sizes)
+    baskets = baskets[(row_sizes > 1) & (row_sizes <= MAX_BASKET)]
+    products = baskets[:, 1]
+    if not len(products):
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+
+    # Pair every row with every row of its order: row i is repeated once
+    # per row of its order and matched against each of them in turn
+    starts, sizes = _runs(baskets[:, 0])
+    row_starts, row_sizes = np.repeat(starts, sizes), np.repeat(sizes, sizes)
+    left = np.repeat(np.arange(len(products)), row_sizes)
+    right = row_starts[left] + np.arange(len(left)) - np.repeat(np.cumsum(row_sizes) - row_sizes, row_sizes)
+    distinct = left != right
+    left, right = left[distinct], right[distinct]
+
+    # Sum the matrix cells as COO entries keyed by a single int64
+    width = int(products.max()) + 1
+    cells, counts = np.unique(products[left] * width + products[right], return_counts=True)
+    return cells // width, cells % width, counts
+
+
+def top_neighbours(product, other, count, k):
+    """Keep each product's `k` highest-count pairs; returns them with their rank"""
+    order = np.lexsort((other, -count, product))
+    product, other, count = product[order], other[order], count[order]
+    starts, sizes = _runs(product)
+    rank = np.arange(len(product)) - np.repeat(starts, sizes)
+    keep = rank < k
+    return product[keep], other[keep], count[keep], rank[keep]
+
+
+def _chunks(ids):
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def _stored_pairs(product_ids):
+    rows = []
+    for chunk in _chunks(product_ids):
+        rows += ProductPair.objects.filter(product__in=chunk).values_list('product', 'other', 'count')
+    return np.array(rows, dtype=np.int64).reshape(-1, 3).T
+
+
+def update_recommendations(full=False, top_k=None):
+    """Fold new orders into the co-occurrence counts and refresh the
+    recommendations of the products they contain.
+
+    With `full`, start over from every order. Returns the RecommendationBuild
+    recorded for the run.
+    """
+    top_k = top_k or settings.RECOMMENDATIONS_PER_PRODUCT
+    with transaction.atomic():
+        last_build = RecommendationBuild.objects.order_by('-pk').first()
+        since = 0 if full or last_build is None else last_build.last_order_id
+        until = Order.objects.aggregate(last=Max('pk'))['last'] or 0
+
+        lines = (
+            OrderItem.objects.filter(order__gt=since, order__lte=until)
+            .exclude(order__status='cancelled')
+            .order_by('order', 'product')
+            .values_list('order', 'product')
+            .distinct()
+        )
+        baskets = np.array(list(lines), dtype=np.int64).reshape(-1, 2)
+        product, other, count = cooccurrence(baskets)
+        touched = np.unique(product)
+        changed = np.ones(len(product), dtype=bool)
+
+        # Products whose recommendations change, for the page cache
+        changed_products = set(touched.tolist())
+        if full:
+            changed_products.update(ProductRecommendation.objects.values_list('product', flat=True).distinct())
+            ProductPair.objects.all().delete()
+            ProductRecommendation.objects.all().delete()
+        elif len(touched):
+            # Add the new counts to the stored ones; the touched products'
+            # stored pairs are all needed to rank their neighbours
+            stored = _stored_pairs(touched.tolist())
+            width = int(max(product.max(), stored[1].max(initial=0))) + 1
+            new_cells = product * width + other
+            cells, inverse = np.unique(np.r_[stored[0] * width + stored[1], new_cells], return_inverse=True)
+            totals = np.bincount(inverse, weights=np.r_[stored[2], count]).astype(np.int64)
+            product, other, count = cells // width, cells % width, totals
+            changed = np.isin(cells, new_cells)
+
+        ProductPair.objects.bulk_create(
+            [
+                ProductPair(product_id=p, other_id=o, count=c)
+                for p, o, c in zip(product[changed].tolist(), other[changed].tolist(), count[changed].tolist())
+            ],
+            batch_size=CHUNK_SIZE,
+            update_conflicts=True,
+            unique_fields=['product', 'other'],
+            update_fields=['count'],
+        )
+
+        for chunk in _chunks(touched.tolist()):
+            ProductRecommendation.objects.filter(product__in=chunk).delete()
+        ProductRecommendation.objects.bulk_create(
+            [
+                ProductRecommendation(product_id=p, recommended_id=o, score=c, rank=r)
+                for p, o, c, r in zip(*(column.tolist() for column in top_neighbours(product, other, count, top_k)))
+            ],
+            batch_size=CHUNK_SIZE,
+        )
+
+        # Cached detail pages show the old recommendations
+        invalidate_product_pages(changed_products)
+        return RecommendationBuild.objects.create(
+            last_order_id=until,
+            orders=len(np.unique(baskets[:, 0])),
+            products=len(touched),
+            full=full,
+        )
+
+
+@periodic(settings.RECOMMENDATIONS_REFRESH_INTERVAL)
+def refresh_recommendations():
+    """Fold in new orders, if there are any; returns the build or None"""
+    last_build = RecommendationBuild.objects.order_by('-pk').first()
+    if not Order.objects.filter(pk__gt=last_build.last_order_id if last_build else 0).exists():
+        return None
+    return update_recommendations()
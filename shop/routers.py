@@ -0,0 +1,61 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+
+# Catalog reads on a separate, read-only connection
+#
+# Views wrapped in @catalog_read send their queries to the "catalog_read"
+# database when one is configured (see settings), leaving the default
+# connection to checkout and the other writers. Without that alias the
+# decorator does nothing.
+
+CATALOG_READ_ALIAS = 'catalog_read'
+
+_reading_catalog = ContextVar('reading_catalog', default=False)
+
+
+@contextmanager
+def reading_catalog():
+    token = _reading_catalog.set(True)
+    try:
+        yield
+    finally:
+        _reading_catalog.reset(token)
+
+
+def catalog_read(view):
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            # The flag is a context variable, so it follows the async ORM's
+            # queries into their worker thread
+            with reading_catalog():
+                return await view(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with reading_catalog():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class CatalogReadRouter:
+    def db_for_read(self, model, **hints):
+        if _reading_catalog.get() and CATALOG_READ_ALIAS in settings.DATABASES:
+            return CATALOG_READ_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases are the same data, so objects may reference each other
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
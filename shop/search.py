@@ -0,0 +1,91 @@
+import re
+
+from django.db import connection, transaction
+from django.db.models import F, FloatField, Q, Value
+
+from .models import Product, ProductSearchIndex
+
+
+FTS_TABLE = ProductSearchIndex._meta.db_table
+
+
+def fts_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def build_match_query(search_query):
+    """Turn free text into an FTS5 query: every word must match as a prefix.
+
+    Words are quoted so FTS5 syntax characters typed by shoppers
+    (AND, NEAR, -, *, :) are treated as plain text.
+    """
+    words = re.findall(r'\w+', search_query.lower())
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_products(queryset, search_query):
+    """Filter `queryset` to products matching `search_query`.
+
+    Matches are annotated with `search_rank` (bm25, lower is better) so
+    callers can order by relevance.
+    """
+    match = build_match_query(search_query)
+    if not match:
+        return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    if not fts_enabled():
+        return queryset.filter(
+            Q(name__icontains=search_query) | Q(description__icontains=search_query)
+        ).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    return queryset.filter(search_index__document__match=match).annotate(
+        search_rank=F('search_index__rank')
+    )
+
+
+def index_products(products):
+    """Insert or refresh the index rows for the given products"""
+    if not fts_enabled():
+        return
+    rows = [(p.pk, p.name, p.description) for p in products]
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)', rows
+        )
+
+
+def remove_products(product_ids):
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in product_ids])
+
+
+def rebuild_index(chunk_size=2000):
+    """Drop every index row and re-index the whole catalog. Returns the row count."""
+    if not fts_enabled():
+        return 0
+    # One transaction, so searches meanwhile keep seeing the old index (WAL)
+    # and a failure partway through leaves it as it was
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+
+        total = 0
+        batch = []
+        products = Product.objects.only('id', 'name', 'description').iterator(chunk_size=chunk_size)
+        for product in products:
+            batch.append(product)
+            if len(batch) >= chunk_size:
+                index_products(batch)
+                total += len(batch)
+                batch = []
+        index_products(batch)
+        total += len(batch)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return total
@@ -0,0 +1,116 @@
+from django.contrib.auth.models import User
+from django.db.models import F
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import search, suggest
+from .auth import forget_user
+from .cart import invalidate_cart_summaries, invalidate_cart_summary
+from .middleware import record_query
+from .models import CartItem, Product, ProductImage, Profile, SellerStats
+from .page_cache import invalidate_catalog_pages
+
+
+# Keep the full-text search index in step with the catalog
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+
+
+# Keep the typeahead index in step with product names
+
+@receiver(pre_save, sender=Product)
+def remember_product_name(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw and (update_fields is None or 'name' in update_fields):
+        instance._suggest_old_name = suggest.saved_name(instance)
+
+
+@receiver(post_save, sender=Product)
+def suggest_saved_product(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw and (update_fields is None or 'name' in update_fields):
+        suggest.product_saved(instance, instance.__dict__.pop('_suggest_old_name', None))
+
+
+@receiver(post_delete, sender=Product)
+def suggest_deleted_product(sender, instance, **kwargs):
+    suggest.product_deleted(instance.pk)
+
+
+# Retire cached anonymous pages that show the changed product
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_catalog_pages([instance.pk])
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_image_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_catalog_pages([instance.product_id])
+
+
+# Drop the cached cart summary whenever a cart changes
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def cart_changed(sender, instance, **kwargs):
+    invalidate_cart_summary(instance.user_id)
+
+
+@receiver(post_save, sender=Product)
+def reprice_carts(sender, instance, created=False, raw=False, **kwargs):
+    # Subtotals of carts holding this product may be stale after a price change
+    if created or raw:
+        return
+    user_ids = CartItem.objects.filter(product=instance).values_list('user_id', flat=True)
+    invalidate_cart_summaries(user_ids)
+
+
+# Product counts on the seller dashboard rollup
+
+@receiver(post_save, sender=Product)
+def count_new_product(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        SellerStats.objects.filter(pk=instance.seller_id).update(total_products=F('total_products') + 1)
+
+
+@receiver(post_delete, sender=Product)
+def drop_seller_stats(sender, instance, **kwargs):
+    # Deleting a product cascades to its order lines, so the totals can't be
+    # patched up incrementally; drop the row and let it rebuild on next view
+    SellerStats.objects.filter(pk=instance.seller_id).delete()
+
+
+# Drop the cached user/profile pair that authenticates requests
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def profile_changed(sender, instance, **kwargs):
+    forget_user(instance.user_id)
+
+
+# Count and time each connection's queries against the request running them
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    # Fired again when a closed connection reconnects; wrap it once
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
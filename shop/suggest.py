@@ -0,0 +1,159 @@
+import re
+import threading
+import time
+import uuid
+from bisect import bisect_left, insort
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import transaction
+
+from .locks import host_lock
+from .models import Product
+
+
+# Typeahead suggestions
+#
+# Each process keeps every product name in memory, once per word so "mug"
+# finds "Red Mug": a sorted list of (lowercased name from that word on,
+# product id) entries, where a prefix lookup is a bisect. Lookups never touch
+# the database. The index is built on the first lookup after the process
+# starts; creating, renaming or deleting a product patches the index of the
+# process that made the change and bumps a version shared through the cache,
+# so other processes rebuild theirs from the Product table.
+
+INDEX_VERSION_KEY = 'suggest-version'
+# How long a process trusts its index before checking the shared version
+VERSION_CHECK_INTERVAL = 1.0
+SUGGEST_LIMIT = 8
+
+
+def _entries(name):
+    name = ' '.join(name.lower().split())
+    return [name[match.start():] for match in re.finditer(r'\w+', name)]
+
+
+class PrefixIndex:
+    def __init__(self, products=()):
+        self.names = {}
+        entries = []
+        for pk, name in products:
+            self.names[pk] = name
+            entries += [(entry, pk) for entry in _entries(name)]
+        entries.sort()
+        self.entries = entries
+
+    def copy(self):
+        index = PrefixIndex()
+        index.names, index.entries = dict(self.names), list(self.entries)
+        return index
+
+    def add(self, pk, name):
+        self.remove(pk)
+        self.names[pk] = name
+        for entry in _entries(name):
+            insort(self.entries, (entry, pk))
+
+    def remove(self, pk):
+        name = self.names.pop(pk, None)
+        if name is None:
+            return
+        for entry in _entries(name):
+            index = bisect_left(self.entries, (entry, pk))
+            if index < len(self.entries) and self.entries[index] == (entry, pk):
+                del self.entries[index]
+
+    def search(self, prefix, limit=SUGGEST_LIMIT):
+        """[(product id, name)] for names with a word starting with `prefix`"""
+        prefix = ' '.join(prefix.lower().split())
+        if not prefix:
+            return []
+        found = {}
+        index = bisect_left(self.entries, (prefix,))
+        while index < len(self.entries) and len(found) < limit:
+            entry, pk = self.entries[index]
+            if not entry.startswith(prefix):
+                break
+            found.setdefault(pk, self.names[pk])
+            index += 1
+        return list(found.items())
+
+
+_lock = threading.Lock()
+_index = None
+_version = None
+_checked_at = 0.0
+
+
+def _shared_version():
+    # add() so a concurrent bump isn't overwritten by our fresh token
+    cache.add(INDEX_VERSION_KEY, uuid.uuid4().hex, None)
+    return cache.get(INDEX_VERSION_KEY)
+
+
+def _refresh():
+    global _index, _version, _checked_at
+    with _lock:
+        version = _shared_version()
+        if _index is None or version != _version:
+            _index = PrefixIndex(Product.objects.values_list('pk', 'name').iterator())
+            _version = version
+        _checked_at = time.monotonic()
+        return _index
+
+
+def _fresh_index():
+    if _index is not None and time.monotonic() - _checked_at < VERSION_CHECK_INTERVAL:
+        return _index
+    return None
+
+
+def suggest(prefix, limit=SUGGEST_LIMIT):
+    index = _fresh_index() or _refresh()
+    return index.search(prefix, limit)
+
+
+async def asuggest(prefix, limit=SUGGEST_LIMIT):
+    index = _fresh_index() or await sync_to_async(_refresh)()
+    return index.search(prefix, limit)
+
+
+def _changed(update):
+    global _index, _version
+    # The host lock makes reading and replacing the shared version one step;
+    # otherwise a change made meanwhile by another process could be
+    # overwritten and never reach this process's index
+    with _lock, host_lock('suggest'):
+        if _index is not None and _shared_version() == _version:
+            # Patch a copy, so lookups running meanwhile see a consistent index
+            index = _index.copy()
+            update(index)
+            _index = index
+        else:
+            # Another process changed the catalog since we last looked, so
+            # patching ours isn't enough; rebuild on the next lookup
+            _index = None
+        _version = uuid.uuid4().hex
+        cache.set(INDEX_VERSION_KEY, _version, None)
+
+
+def saved_name(product):
+    """The name `product` has in the database, before a save changes it"""
+    if product._state.adding:
+        return None
+    return Product.objects.filter(pk=product.pk).values_list('name', flat=True).first()
+
+
+def product_saved(product, old_name):
+    """Index `product` under its current name once the transaction commits.
+
+    `old_name` is what saved_name() returned before the save; most saves
+    (price, stock, description) leave the name alone and change nothing.
+    """
+    pk, name = product.pk, product.name
+    if name != old_name:
+        transaction.on_commit(lambda: _changed(lambda index: index.add(pk, name)))
+
+
+def product_deleted(product_id):
+    transaction.on_commit(lambda: _changed(lambda index: index.remove(product_id)))
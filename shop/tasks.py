@@ -0,0 +1,80 @@
+from django.conf import settings
+from django.core.mail import send_mail
+
+from .images import render_renditions
+from .jobs import enqueue, register
+from .models import Order, ProductImage, ReturnRequest
+from .page_cache import invalidate_catalog_pages
+
+
+# Job handlers, run by `manage.py run_worker` (see shop.jobs)
+
+@register('render_product_image')
+def render_product_image(image_id):
+    """Generate an uploaded image's renditions and store its dimensions"""
+    image = ProductImage.objects.filter(pk=image_id).values('image', 'product_id').first()
+    if image is None:
+        return  # Deleted before the worker got to it
+    width, height = render_renditions(str(settings.MEDIA_ROOT), image['image'])
+    ProductImage.objects.filter(pk=image_id).update(width=width, height=height)
+    # Cached pages were rendered without the new srcset
+    invalidate_catalog_pages([image['product_id']])
+
+
+def queue_image_renditions(images):
+    for image in images:
+        enqueue('render_product_image', {'image_id': image.pk}, key=f'render-image:{image.pk}')
+
+
+@register('notify_order_status')
+def notify_order_status(order_id, status):
+    """Email the customer that their order moved to `status`"""
+    order = Order.objects.select_related('customer').filter(pk=order_id).first()
+    # Skip updates that a later status change has already superseded
+    if order is None or order.status != status or not order.customer.email:
+        return
+    send_mail(
+        f'Order #{order.pk}: {order.get_status_display()}',
+        f'Hi {order.customer.username},\n\n'
+        f'Your order #{order.pk} is now {order.get_status_display().lower()}.\n\n'
+        'Thank you for shopping with LazyShops.',
+        None,
+        [order.customer.email],
+    )
+
+
+@register('notify_return_status')
+def notify_return_status(return_request_id, status):
+    """Email the customer that their return request moved to `status`"""
+    return_request = (
+        ReturnRequest.objects.select_related('order__customer').filter(pk=return_request_id).first()
+    )
+    if return_request is None or return_request.status != status:
+        return
+    customer = return_request.order.customer
+    if not customer.email:
+        return
+    message = f'Your return request for order #{return_request.order_id} is now {return_request.get_status_display().lower()}.'
+    if return_request.admin_response:
+        message += f'\n\nSeller response: {return_request.admin_response}'
+    send_mail(
+        f'Return for order #{return_request.order_id}: {return_request.get_status_display()}',
+        f'Hi {customer.username},\n\n{message}\n\nThank you for shopping with LazyShops.',
+        None,
+        [customer.email],
+    )
+
+
+# Keyed on the status change itself: the record's count of status changes
+# (bumped in the same transaction as the status) and the new status. An
+# enqueue retried for the same change adds nothing, while a later return to
+# an earlier status is a new change and notifies again.
+
+def queue_order_notification(order):
+    enqueue('notify_order_status', {'order_id': order.pk, 'status': order.status},
+            key=f'order-status:{order.pk}:{order.status_changes}:{order.status}')
+
+
+def queue_return_notification(return_request):
+    enqueue('notify_return_status', {'return_request_id': return_request.pk, 'status': return_request.status},
+            key=f'return-status:{return_request.pk}:{return_request.status_changes}:{return_request.status}')
@@ -0,0 +1,16 @@
+from django import template
+
+register = template.Library()
+
+@register.inclusion_tag('includes/responsive_image.html')
+def responsive_image(image, alt='', sizes='100vw', css_class='', element_id='', lazy=True, onclick=''):
+    """Render a <picture> with WebP/JPEG srcsets for data from get_responsive_data()"""
+    return {
+        'image': image,
+        'alt': alt,
+        'sizes': sizes,
+        'css_class': css_class,
+        'element_id': element_id,
+        'lazy': lazy,
+        'onclick': onclick,
+    }
@@ -0,0 +1,32 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from shop.page_cache import product_versions
+
+register = template.Library()
+
+@register.simple_tag
+def product_fragments(products, template_name):
+    """Render `template_name` once per product, reusing cached fragments.
+
+    Fragments are keyed on the product's page version (see shop.page_cache),
+    which every change to the product or its images replaces, so a stale
+    card is never read. A warm page costs two cache reads in total.
+    """
+    products = list(products)
+    versions = product_versions(product.pk for product in products)
+    keys = {product.pk: f'fragment:{template_name}:{product.pk}:{versions[product.pk]}' for product in products}
+    fragments = cache.get_many(keys.values())
+
+    missing = {}
+    for product in products:
+        key = keys[product.pk]
+        if key not in fragments:
+            fragments[key] = missing[key] = get_template(template_name).render({'product': product})
+    if missing:
+        cache.set_many(missing, settings.PRODUCT_FRAGMENT_CACHE_TIMEOUT)
+
+    return mark_safe(''.join(fragments[keys[product.pk]] for product in products))
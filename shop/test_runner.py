@@ -0,0 +1,26 @@
+import os
+import tempfile
+
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class IsolatedCacheTestRunner(DiscoverRunner):
+    """DiscoverRunner with a private in-memory cache and lock directory.
+
+    The tests clear the cache between tests; without this a test run would
+    wipe the pages, sessions and rate limits of a development server sharing
+    the file cache.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.isolated_cache = override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+            LOCK_DIR=os.path.join(tempfile.gettempdir(), 'lazyshops-test-locks'),
+        )
+        self.isolated_cache.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.isolated_cache.disable()
+        super().teardown_test_environment(**kwargs)
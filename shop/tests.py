@@ -1,3 +1,1353 @@
-from django.test import TestCase
+import csv
+import datetime
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.template import Context, Template
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import jobs, metrics, suggest, throttle, urls as shop_urls
+from .cart import aget_cart_summary, get_cart_summary
+from .exports import SALES_COLUMNS, parquet_available
+from .facets import facet_counts, parse_filters
+from .inventory import expire_holds
+from .images import render_renditions, rendition_name, responsive_image_data
+from .models import (
+    CartItem, InsufficientStock, Job, Order, OrderItem, Product, ProductImage, ProductPair, ProductSearchIndex,
+    Profile, ReturnRequest, SellerStats, StockHold, StockMovement,
+)
+from .page_cache import catalog_version, product_versions
+from .pagination import InvalidCursor, KeysetPaginator, approximate_count
+from .recommendations import cooccurrence, refresh_recommendations, update_recommendations
+from .routers import CatalogReadRouter, reading_catalog
+from .search import rebuild_index, search_products
+from .tasks import queue_order_notification
+
+
+class KeysetPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seller = User.objects.create_user(username='seller', password='pass')
+        # Repeated prices make sure ties are broken on id
+        for i in range(7):
+            Product.objects.create(
+                name=f'Product {i}',
+                description='',
+                price=Decimal(10 + i // 2),
+                stock=i,
+                seller=seller,
+            )
+
+    def walk(self, ordering):
+        paginator = KeysetPaginator(Product.objects.all(), ordering, per_page=3)
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        return paginator, pages
+
+    def test_forward_walk_matches_offset_ordering(self):
+        for ordering, tiebreak in [('price', 'id'), ('-price', '-id'), ('name', 'id'), ('-created_at', '-id')]:
+            _, pages = self.walk(ordering)
+            walked = [p.id for page in pages for p in page]
+            expected = list(Product.objects.order_by(ordering, tiebreak).values_list('id', flat=True))
+            self.assertEqual(walked, expected, ordering)
+
+    def test_previous_cursor_returns_same_page(self):
+        paginator, pages = self.walk('-price')
+        back = paginator.page(pages[2].prev_cursor)
+        self.assertEqual([p.id for p in back], [p.id for p in pages[1]])
+        first = paginator.page(pages[1].prev_cursor)
+        self.assertFalse(first.has_previous())
+        self.assertEqual([p.id for p in first], [p.id for p in pages[0]])
+
+    def test_bad_or_stale_cursor_is_rejected(self):
+        paginator = KeysetPaginator(Product.objects.all(), 'price', per_page=3)
+        stale = KeysetPaginator(Product.objects.all(), 'name', per_page=3).page().next_cursor
+        for cursor in ['garbage', stale]:
+            with self.assertRaises(InvalidCursor):
+                paginator.page(cursor)
+
+    def test_cursor_past_deleted_rows_ends_the_walk(self):
+        paginator, pages = self.walk('price')
+        Product.objects.filter(pk__in=[p.pk for p in pages[-1]]).delete()
+        page = paginator.page(pages[-2].next_cursor)
+        self.assertEqual((len(page), page.has_next()), (0, False))
+
+    def test_approximate_count_is_capped(self):
+        self.assertEqual(approximate_count(Product.objects.all()), (7, False))
+        self.assertEqual(approximate_count(Product.objects.all(), cap=5), (5, True))
+
+
+class ProductSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='pass')
+        cls.phone = cls.make('Galaxy Phone', 'Android smartphone with a great camera')
+        cls.case = cls.make('Leather Case', 'Protective case for your phone')
+        cls.lamp = cls.make('Desk Lamp', 'Warm LED light')
+
+    @classmethod
+    def make(cls, name, description):
+        return Product.objects.create(
+            name=name, description=description, price=Decimal('10.00'), stock=1, seller=cls.seller
+        )
+
+    def search(self, query):
+        return list(search_products(Product.objects.all(), query).order_by('search_rank', 'id'))
+
+    def test_matches_name_and_description_ranked_by_name(self):
+        self.assertEqual(self.search('phone'), [self.phone, self.case])
+
+    def test_prefix_and_punctuation(self):
+        self.assertEqual(self.search('gal'), [self.phone])
+        self.assertEqual(self.search('lamp -"*'), [self.lamp])
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_index_follows_save_and_delete(self):
+        self.lamp.name = 'Reading Light'
+        self.lamp.save()
+        self.assertEqual(self.search('lamp'), [])
+        self.assertEqual(self.search('reading'), [self.lamp])
+        self.case.delete()
+        self.assertEqual(self.search('phone'), [self.phone])
+
+    def test_rebuild_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM shop_product_fts')
+        self.assertEqual(self.search('phone'), [])
+        self.assertEqual(rebuild_index(), 3)
+        self.assertEqual(self.search('phone'), [self.phone, self.case])
+
+    def test_failed_rebuild_keeps_the_old_index(self):
+        with mock.patch('shop.search.index_products', side_effect=RuntimeError('disk full')):
+            with self.assertRaises(RuntimeError):
+                rebuild_index()
+        self.assertEqual(self.search('phone'), [self.phone, self.case])
+
+
+class SearchSuggestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='pass')
+        cls.red_mug = Product.objects.create(name='Red Mug', description='', price=Decimal('4.00'), stock=1, seller=cls.seller)
+        cls.mug_rack = Product.objects.create(name='Mug  Rack', description='', price=Decimal('9.00'), stock=1, seller=cls.seller)
+        cls.lamp = Product.objects.create(name='Lamp', description='', price=Decimal('20.00'), stock=1, seller=cls.seller)
+
+    def setUp(self):
+        cache.clear()
+        suggest._index = None
+
+    def names(self, query):
+        response = self.client.get(reverse('search_suggest'), {'q': query})
+        return [item['name'] for item in response.json()['suggestions']]
+
+    def test_prefix_index(self):
+        index = suggest.PrefixIndex([(1, 'Red Mug'), (2, 'Mug Rack'), (3, 'Mugwort Tea')])
+        # Ordered by the matching word onwards, shortest first
+        self.assertEqual(index.search('mug'), [(1, 'Red Mug'), (2, 'Mug Rack'), (3, 'Mugwort Tea')])
+        self.assertEqual(index.search('MUG  r'), [(2, 'Mug Rack')])
+        self.assertEqual(index.search('mug', limit=1), [(1, 'Red Mug')])
+        index.remove(2)
+        self.assertEqual(index.search('rack'), [])
+        self.assertEqual(index.search(''), [])
+
+    def test_suggestions_come_from_memory(self):
+        self.assertEqual(self.names('mu'), ['Red Mug', 'Mug  Rack'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('re'), ['Red Mug'])
+
+    def test_saves_and_deletes_update_the_index(self):
+        self.names('mug')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.red_mug.name = 'Blue Cup'
+            self.red_mug.save()
+            self.mug_rack.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('mug'), [])
+            self.assertEqual(self.names('cup'), ['Blue Cup'])
+
+    def test_saves_that_keep_the_name_leave_the_version_alone(self):
+        self.names('mug')
+        version = cache.get(suggest.INDEX_VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.red_mug.price = Decimal('5.00')
+            self.red_mug.save()
+            self.lamp.stock = 0
+            self.lamp.save(update_fields=['stock'])
+        self.assertEqual(cache.get(suggest.INDEX_VERSION_KEY), version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='Mug Tree', description='', price=Decimal('6.00'), stock=1, seller=self.seller)
+        self.assertNotEqual(cache.get(suggest.INDEX_VERSION_KEY), version)
+        self.assertIn('Mug Tree', self.names('mug'))
+
+    def test_other_processes_changes_trigger_a_rebuild(self):
+        self.names('mug')
+        Product.objects.filter(pk=self.red_mug.pk).update(name='Mugwort')
+        cache.set(suggest.INDEX_VERSION_KEY, 'bumped elsewhere', None)
+        suggest._checked_at = 0
+        self.assertEqual(self.names('mugw'), ['Mugwort'])
+
+
+class AuthenticationCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='sam', password='pass')
+        cls.profile = Profile.objects.create(user=cls.user, user_type='customer')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_user_and_profile_come_from_the_cache(self):
+        self.client.get(reverse('order_history'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('order_history'))
+        self.assertFalse([q for q in queries if 'auth_user' in q['sql'] or 'django_session' in q['sql']])
+
+    def test_role_checks_see_profile_changes(self):
+        response = self.client.get(reverse('seller_dashboard'))
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        self.assertEqual(self.client.get(reverse('seller_orders_page')).status_code, 403)
+
+        self.profile.user_type = 'seller'
+        self.profile.save()
+        self.assertEqual(self.client.get(reverse('seller_dashboard')).status_code, 200)
+        response = self.client.get(reverse('cart'))
+        self.assertRedirects(response, reverse('seller_dashboard'), fetch_redirect_response=False)
+
+    def test_changing_the_password_ends_other_sessions(self):
+        self.client.get(reverse('order_history'))
+        self.user.set_password('new-pass')
+        self.user.save()
+        response = self.client.get(reverse('order_history'))
+        self.assertRedirects(response, f"{reverse('login')}?next={reverse('order_history')}", fetch_redirect_response=False)
+
+
+@override_settings(THROTTLE_RATES={'login-ip': (4, 60), 'login-username': (2, 60)})
+class LoginThrottleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='sam', password='right-pass')
+
+    def setUp(self):
+        cache.clear()
+
+    def attempt(self, password, username='sam'):
+        return self.client.post(reverse('login'), {'username': username, 'password': password})
+
+    def refused_wait(self, *buckets):
+        try:
+            throttle.take(*buckets)
+        except throttle.Throttled as exc:
+            return exc.wait
+        return 0
+
+    def test_token_bucket_refills_over_time(self):
+        sam = ('login-username', 'sam')
+        with mock.patch('shop.throttle.time.time', return_value=1000.0):
+            self.assertEqual(self.refused_wait(sam), 0)
+            self.assertEqual(self.refused_wait(sam), 0)
+            self.assertEqual(self.refused_wait(sam), 60)
+        with mock.patch('shop.throttle.time.time', return_value=1030.0):
+            self.assertEqual(self.refused_wait(sam), 30)
+            # Refused on the username, so the IP's token isn't spent either
+            for _ in range(5):
+                self.refused_wait(('login-ip', '10.0.0.1'), sam)
+            self.assertEqual([self.refused_wait(('login-ip', '10.0.0.1')) for _ in range(4)], [0] * 4)
+        with mock.patch('shop.throttle.time.time', return_value=1060.0):
+            self.assertEqual(self.refused_wait(sam), 0)
+
+    def test_concurrent_attempts_cannot_overspend(self):
+        allowed = []
+        barrier = threading.Barrier(20)
+
+        def attempt():
+            barrier.wait()
+            if not self.refused_wait(('login-ip', '10.0.0.2')):
+                allowed.append(1)
+
+        threads = [threading.Thread(target=attempt) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(allowed), 4)
+
+    def test_excess_attempts_are_refused_before_hashing(self):
+        before = metrics.login_throttled.value(scope='login-username')
+        self.attempt('wrong')
+        with mock.patch('shop.views.authenticate', return_value=None) as authenticate:
+            self.attempt('wrong')
+            response = self.attempt('right-pass')
+        self.assertEqual(authenticate.call_count, 1)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(metrics.login_throttled.value(scope='login-username'), before + 1)
+
+        # The IP's bucket runs dry too, whatever username is tried (the
+        # refused attempt above didn't spend from it)
+        self.attempt('wrong', username='other')
+        self.attempt('wrong', username='another')
+        self.assertEqual(self.attempt('wrong', username='someone').status_code, 429)
+
+    def test_successful_login_refills_the_username_bucket(self):
+        # authenticate()'s user lookup is the only query; no separate existence check
+        with self.assertNumQueries(1):
+            self.attempt('wrong')
+        self.assertRedirects(self.attempt('right-pass'), reverse('home'), fetch_redirect_response=False)
+        self.client.logout()
+        self.assertEqual(self.attempt('wrong').status_code, 302)
+        self.assertEqual(self.attempt('wrong').status_code, 302)
+
+
+class ProductCardQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='pass')
+        Profile.objects.create(user=cls.seller, user_type='seller')
+        for i in range(5):
+            product = Product.objects.create(
+                name=f'Product {i}', description='', price=Decimal('10.00'), stock=1, seller=cls.seller
+            )
+            for order in (1, 0):
+                ProductImage.objects.create(product=product, image=f'products/{i}-{order}.jpg', order=order)
+        cls.product = product
+
+    def setUp(self):
+        cache.clear()
+
+    def test_card_data_annotations(self):
+        product = Product.objects.with_card_data().get(pk=self.product.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(product.get_image_count(), 2)
+            self.assertEqual(product.get_primary_image(), '/media/products/4-0.jpg')
+
+    def test_home_query_count_does_not_grow_with_products(self):
+        # Count, facet counts (cold cache) and the page of products
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('home'))
+        self.assertContains(response, '/media/products/0-0.jpg')
+
+    def test_product_detail_prefetches_gallery(self):
+        # Product, gallery and recommendations
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('product_detail', args=[self.product.pk]))
+        self.assertContains(response, '/media/products/4-1.jpg')
+
+    def test_seller_dashboard_product_table(self):
+        self.client.force_login(self.seller)
+        response = self.client.get(reverse('seller_dashboard'))
+        self.assertContains(response, '/media/products/3-0.jpg')
+
+    def test_cards_are_cached_until_the_product_changes(self):
+        self.client.force_login(self.seller)
+        for url in (reverse('home'), reverse('seller_dashboard')):
+            self.client.get(url)
+            # update() sends no signal, so the cached card is still current
+            Product.objects.filter(pk=self.product.pk).update(name='Renamed')
+            self.assertContains(self.client.get(url), 'Product 4')
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.refresh_from_db()
+                self.product.save()
+            response = self.client.get(url)
+            self.assertContains(response, 'Renamed')
+            self.assertContains(response, 'Product 3')
+            Product.objects.filter(pk=self.product.pk).update(name='Product 4')
+
+
+class CatalogFacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user(username='alice', password='pass')
+        cls.bob = User.objects.create_user(username='bob', password='pass')
+        for name, price, stock, seller in [
+            ('Red Mug', '300.00', 4, cls.alice),
+            ('Blue Mug', '700.00', 0, cls.alice),
+            ('Green Mug', '2500.00', 2, cls.bob),
+            ('Lamp', '25000.00', 1, cls.bob),
+        ]:
+            Product.objects.create(name=name, description='', price=Decimal(price), stock=stock, seller=seller)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_each_facet_ignores_its_own_filter(self):
+        filters = parse_filters({'search': 'mug', 'stock': 'in_stock', 'seller': str(self.alice.pk)})
+        with self.assertNumQueries(1):
+            facets = facet_counts(filters)
+        # Stock counts keep the seller filter but not the stock one
+        self.assertEqual(facets['stock'], {'in_stock': 1, 'out_of_stock': 1})
+        self.assertEqual([bucket['count'] for bucket in facets['price']], [1, 0, 0, 0, 0])
+        # Seller counts keep the stock filter but not the seller one
+        self.assertEqual(
+            [(s['username'], s['count'], s['selected']) for s in facets['sellers']],
+            [('alice', 1, True), ('bob', 1, False)],
+        )
+
+    def test_counts_are_cached_until_the_catalog_changes(self):
+        filters = parse_filters({'max_price': '1000'})
+        facet_counts(filters)
+        with self.assertNumQueries(0):
+            self.assertEqual(facet_counts(parse_filters({'max_price': '1000.00'}))['stock']['in_stock'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='Plate', description='', price=Decimal('50.00'), stock=1, seller=self.bob)
+        self.assertEqual(facet_counts(filters)['stock']['in_stock'], 2)
+
+    def test_invalid_filters_are_dropped(self):
+        filters = parse_filters({'min_price': 'NaN', 'max_price': '-5', 'stock': 'sold', 'seller': 'x'})
+        self.assertEqual(filters, {'search': '', 'min_price': None, 'max_price': None, 'stock': '', 'seller': None})
+
+    def test_home_links_facets(self):
+        response = self.client.get(reverse('home'), {'seller': self.bob.pk})
+        self.assertContains(response, 'In Stock (2)')
+        self.assertContains(response, f'name="seller" value="{self.bob.pk}"')
+        self.assertNotContains(response, 'Red Mug')
+
+
+class AnonymousPageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='pass')
+        cls.mug, cls.lamp = [
+            Product.objects.create(name=name, description='', price=Decimal('5.00'), stock=3, seller=cls.seller)
+            for name in ('Mug', 'Lamp')
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, url):
+        response = self.client.get(url)
+        return response, response['X-Page-Cache']
+
+    def test_pages_are_served_from_cache(self):
+        for url in (reverse('home'), reverse('home') + '?sort=price_low', reverse('product_detail', args=[self.mug.pk])):
+            self.assertEqual(self.get(url)[1], 'miss')
+            with self.assertNumQueries(0):
+                response, status = self.get(url)
+            self.assertEqual(status, 'hit')
+            self.assertContains(response, 'Mug')
+
+    def test_product_change_invalidates_its_pages_only(self):
+        mug_url = reverse('product_detail', args=[self.mug.pk])
+        lamp_url = reverse('product_detail', args=[self.lamp.pk])
+        for url in (reverse('home'), mug_url, lamp_url):
+            self.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.mug.pk).update(stock=0)
+            self.mug.refresh_from_db()
+            self.mug.save()
+
+        response, status = self.get(mug_url)
+        self.assertEqual(status, 'miss')
+        self.assertContains(response, 'Out of Stock')
+        self.assertEqual(self.get(reverse('home'))[1], 'miss')
+        self.assertEqual(self.get(lamp_url)[1], 'hit')
+
+    def test_logged_in_users_bypass_cache(self):
+        self.client.force_login(self.seller)
+        self.assertFalse(self.client.get(reverse('home')).has_header('X-Page-Cache'))
+
+    async def test_async_views_are_cached_under_asgi(self):
+        for url in (reverse('home') + '?sort=name', reverse('product_detail', args=[self.mug.pk])):
+            response = await self.async_client.get(url)
+            self.assertEqual(response['X-Page-Cache'], 'miss')
+            self.assertContains(response, 'Lamp' if '?' in url else 'Mug')
+            response = await self.async_client.get(url)
+            self.assertEqual(response['X-Page-Cache'], 'hit')
+
+
+class ImageRenditionTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.settings_override = override_settings(MEDIA_ROOT=media_root)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.media_root = media_root
+        os.makedirs(os.path.join(media_root, 'products'))
+        Image.new('RGBA', (800, 400), (255, 0, 0, 128)).save(os.path.join(media_root, 'products/shoe.png'))
+
+    def test_render_renditions_writes_smaller_widths_only(self):
+        self.assertEqual(render_renditions(self.media_root, 'products/shoe.png'), (800, 400))
+        for width in (320, 640):
+            for ext in ('webp', 'jpg'):
+                with Image.open(os.path.join(self.media_root, rendition_name('products/shoe.png', width, ext))) as image:
+                    self.assertEqual(image.size, (width, width // 2))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'products/renditions/shoe.png-1024w.jpg')))
+
+    def test_rendition_name(self):
+        self.assertEqual(rendition_name('products/shoe.png', 640, 'webp'), 'products/renditions/shoe.png-640w.webp')
+        self.assertEqual(rendition_name('shoe.png', 320, 'jpg'), 'renditions/shoe.png-320w.jpg')
+        # Same stem, different original: separate files
+        self.assertNotEqual(rendition_name('products/shoe.jpg', 640, 'jpg'), rendition_name('products/shoe.png', 640, 'jpg'))
+
+    def test_responsive_image_tag(self):
+        data = responsive_image_data('products/shoe.png', 800, 400)
+        html = Template('{% load image_tags %}{% responsive_image image alt="Shoe" sizes="50vw" %}').render(
+            Context({'image': data})
+        )
+        self.assertIn('<source type="image/webp" srcset="/media/products/renditions/shoe.png-320w.webp 320w, '
+                      '/media/products/renditions/shoe.png-640w.webp 640w" sizes="50vw">', html)
+        self.assertIn('/media/products/renditions/shoe.png-640w.jpg 640w, /media/products/shoe.png 800w', html)
+        self.assertIn('width="800" height="400"', html)
+
+    def test_unprocessed_image_renders_plain_img(self):
+        html = Template('{% load image_tags %}{% responsive_image image %}').render(
+            Context({'image': responsive_image_data('products/shoe.png')})
+        )
+        self.assertNotIn('srcset', html)
+        self.assertIn('src="/media/products/shoe.png"', html)
+
+
+class CheckoutTests(TransactionTestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', password='pass')
+        self.product = Product.objects.create(
+            name='Limited Sneaker', description='', price=Decimal('99.50'), stock=3, seller=self.seller
+        )
+        self.other = Product.objects.create(
+            name='Socks', description='', price=Decimal('5.25'), stock=10, seller=self.seller
+        )
+
+    def buyer(self, username, *items):
+        user = User.objects.create_user(username=username, password='pass')
+        for product, quantity in items:
+            CartItem.objects.create(user=user, product=product, quantity=quantity)
+        return user
+
+    def test_order_is_built_from_cart(self):
+        user = self.buyer('buyer', (self.product, 2), (self.other, 3))
+        order = Order.place_from_cart(user, 'Somewhere', '123')
+        self.assertEqual(order.total_price, Decimal('214.75'))
+        self.assertEqual(order.items.count(), 2)
+        self.assertFalse(CartItem.objects.filter(user=user).exists())
+        self.product.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.product.stock, self.other.stock), (1, 7))
+
+    def test_short_item_rolls_back_whole_order(self):
+        user = self.buyer('buyer', (self.other, 2), (self.product, 4))
+        with self.assertRaises(InsufficientStock):
+            Order.place_from_cart(user, 'Somewhere', '123')
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.stock, 10)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.filter(user=user).count(), 2)
+
+    def test_parallel_buyers_never_oversell(self):
+        buyers = [self.buyer(f'buyer{i}', (self.product, 1)) for i in range(8)]
+        barrier = threading.Barrier(len(buyers))
+        results = []
+
+        def checkout(user):
+            try:
+                barrier.wait()
+                Order.place_from_cart(user, 'Somewhere', '123')
+                results.append('ok')
+            except InsufficientStock:
+                results.append('short')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(user,)) for user in buyers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.product.refresh_from_db()
+        self.assertEqual(results.count('ok'), 3)
+        self.assertEqual(results.count('short'), 5)
+        self.assertEqual(self.product.stock, 0)
+        self.assertEqual(OrderItem.objects.filter(product=self.product).count(), 3)
+
+    def test_parallel_adds_count_every_unit(self):
+        user = self.buyer('buyer')
+        barrier = threading.Barrier(4)
+
+        def add():
+            client = Client()
+            client.force_login(user)
+            try:
+                barrier.wait()
+                client.get(reverse('add_to_cart', args=[self.other.pk]))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(CartItem.objects.get(user=user).quantity, 4)
+        self.assertEqual(StockHold.objects.get(user=user).quantity, 4)
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.stock, 6)
+
+
+class CartSummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seller = User.objects.create_user(username='seller', password='pass')
+        cls.customer = User.objects.create_user(username='customer', password='pass')
+        Profile.objects.create(user=cls.customer)
+        cls.product = Product.objects.create(
+            name='Mug', description='', price=Decimal('4.50'), stock=10, seller=seller
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.customer)
+
+    def test_summary_is_cached_and_invalidated(self):
+        item = CartItem.objects.create(user=self.customer, product=self.product, quantity=2)
+        self.assertEqual(get_cart_summary(self.customer), {'item_count': 2, 'subtotal': Decimal('9.00')})
+        with self.assertNumQueries(0):
+            get_cart_summary(self.customer)
+
+        # Dropped only once the change commits
+        with self.captureOnCommitCallbacks(execute=True):
+            item.quantity = 3
+            item.save()
+            self.assertEqual(get_cart_summary(self.customer)['item_count'], 2)
+        self.assertEqual(get_cart_summary(self.customer)['item_count'], 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = Decimal('5.00')
+            self.product.save()
+        self.assertEqual(get_cart_summary(self.customer)['subtotal'], Decimal('15.00'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            item.delete()
+        self.assertEqual(get_cart_summary(self.customer), {'item_count': 0, 'subtotal': Decimal('0.00')})
+
+    def test_cart_page_queries_do_not_grow_with_items(self):
+        for i in range(4):
+            product = Product.objects.create(
+                name=f'Item {i}', description='', price=Decimal('1.00'), stock=5, seller=self.product.seller
+            )
+            ProductImage.objects.create(product=product, image=f'products/{i}.jpg')
+            CartItem.objects.create(user=self.customer, product=product)
+        get_cart_summary(self.customer)
+        with self.assertNumQueries(3):
+            # user + profile (cold cache), cart items + products, images
+            response = self.client.get(reverse('cart'))
+        self.assertContains(response, '/media/products/3.jpg')
+        self.assertContains(response, '₹4.00')
+
+    async def test_cart_page_under_asgi(self):
+        await CartItem.objects.acreate(user=self.customer, product=self.product, quantity=2)
+        self.assertEqual(await aget_cart_summary(self.customer), {'item_count': 2, 'subtotal': Decimal('9.00')})
+        await self.async_client.aforce_login(self.customer)
+        response = await self.async_client.get(reverse('cart'))
+        self.assertContains(response, 'Mug')
+        self.assertContains(response, '₹9.00')
+        self.assertContains(response, 'Cart Items (1)')
+        self.assertContains(response, 'Subtotal (1 items)')
+
+
+class SellerStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='pass')
+        Profile.objects.create(user=cls.seller, user_type='seller')
+        cls.other_seller = User.objects.create_user(username='other', password='pass')
+        cls.customer = User.objects.create_user(username='customer', password='pass')
+        Profile.objects.create(user=cls.customer)
+        cls.lamp = Product.objects.create(
+            name='Lamp', description='', price=Decimal('20.00'), stock=50, seller=cls.seller
+        )
+        cls.chair = Product.objects.create(
+            name='Chair', description='', price=Decimal('35.00'), stock=50, seller=cls.other_seller
+        )
+
+    def order(self, *items):
+        for product, quantity in items:
+            CartItem.objects.create(user=self.customer, product=product, quantity=quantity)
+        return Order.place_from_cart(self.customer, 'Somewhere', '123')
+
+    def assertMatchesRebuild(self, seller):
+        stats = SellerStats.objects.get(pk=seller.pk)
+        fresh = SellerStats.rebuild_for(seller.pk)
+        fields = ['total_sales', 'total_orders', 'total_refunded', 'total_products']
+        self.assertEqual([getattr(stats, f) for f in fields], [getattr(fresh, f) for f in fields])
+        return fresh
+
+    def test_incremental_updates_match_rebuild(self):
+        SellerStats.rebuild_for(self.seller.pk)
+        first = self.order((self.lamp, 2), (self.chair, 1))
+        self.order((self.lamp, 1))
+        stats = self.assertMatchesRebuild(self.seller)
+        self.assertEqual((stats.total_sales, stats.total_orders), (Decimal('60.00'), 2))
+
+        with SellerStats.track(first):
+            first.status = 'cancelled'
+            first.save()
+        stats = self.assertMatchesRebuild(self.seller)
+        self.assertEqual((stats.total_sales, stats.total_orders), (Decimal('20.00'), 1))
+
+        second = Order.objects.exclude(pk=first.pk).get()
+        second.status = 'delivered'
+        second.save()
+        return_request = ReturnRequest.objects.create(order=second, reason='Broken', refund_amount=Decimal('20.00'))
+        with SellerStats.track(second):
+            return_request.status = 'refund_completed'
+            return_request.save()
+        stats = self.assertMatchesRebuild(self.seller)
+        self.assertEqual((stats.total_sales, stats.total_refunded), (Decimal('0.00'), Decimal('20.00')))
+
+        Product.objects.create(name='Desk', description='', price=Decimal('5.00'), seller=self.seller)
+        self.assertEqual(self.assertMatchesRebuild(self.seller).total_products, 2)
+
+    def test_dashboard_header_reads_rollup(self):
+        self.order((self.lamp, 3))
+        self.client.force_login(self.seller)
+        response = self.client.get(reverse('seller_dashboard'))
+        self.assertEqual(response.context['total_sales'], Decimal('60.00'))
+        self.assertEqual(response.context['total_orders'], 1)
+        self.assertEqual(response.context['total_products'], 1)
+
+
+class SellerDashboardTableTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='pass')
+        Profile.objects.create(user=cls.seller, user_type='seller')
+        customer = User.objects.create_user(username='customer', password='pass')
+        product = Product.objects.create(
+            name='Lamp', description='', price=Decimal('20.00'), stock=100, seller=cls.seller
+        )
+        start = timezone.make_aware(datetime.datetime(2025, 1, 1))
+        for day in range(30):
+            order = Order.objects.create(
+                customer=customer, total_price=Decimal('20.00'), address='x', phone='1',
+                date=start + datetime.timedelta(days=day),
+                status='delivered' if day % 3 == 0 else 'pending',
+            )
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=Decimal('20.00'))
+            if day % 3 == 0:
+                ReturnRequest.objects.create(order=order, reason='Changed my mind')
+
+    def setUp(self):
+        self.client.force_login(self.seller)
+
+    def fetch_all(self, url, **params):
+        rows, cursor = 0, None
+        while True:
+            query = dict(params, **({'cursor': cursor} if cursor else {}))
+            data = self.client.get(url, query).json()
+            rows += data['html'].count('<tr>')
+            cursor = data['next_cursor']
+            if not cursor:
+                return rows
+
+    def test_dashboard_renders_only_first_page(self):
+        response = self.client.get(reverse('seller_dashboard'))
+        self.assertEqual(len(response.context['orders']), 25)
+        self.assertTrue(response.context['orders'].has_next())
+        self.assertNotContains(response, 'Changed my mind')
+
+    def test_order_pages_and_filters(self):
+        url = reverse('seller_orders_page')
+        self.assertEqual(self.fetch_all(url), 30)
+        self.assertEqual(self.fetch_all(url, status='delivered'), 10)
+        self.assertEqual(self.fetch_all(url, date_from='2025-01-10', date_to='2025-01-19'), 10)
+        self.assertEqual(self.fetch_all(url, date_from='2025-02-30'), 30)
+
+    def test_return_pages_and_filters(self):
+        url = reverse('seller_returns_page')
+        self.assertEqual(self.fetch_all(url), 10)
+        data = self.client.get(url, {'status': 'approved'}).json()
+        self.assertIn('No return requests found', data['html'])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_stale_cursor_asks_the_table_to_reset(self):
+        cursor = self.client.get(reverse('seller_orders_page')).json()['next_cursor']
+        response = self.client.get(reverse('seller_returns_page'), {'cursor': cursor})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'status': 'error', 'reset': True})
+        response = self.client.get(reverse('seller_dashboard'), {'cursor': 'garbage'})
+        self.assertRedirects(response, reverse('seller_dashboard'), fetch_redirect_response=False)
+
+    def test_customers_cannot_read_seller_tables(self):
+        self.client.force_login(User.objects.get(username='customer'))
+        self.assertEqual(self.client.get(reverse('seller_orders_page')).status_code, 403)
+
+    def test_csv_export_streams_filtered_lines(self):
+        response = self.client.get(reverse('seller_sales_export'), {'format': 'csv', 'status': 'delivered'})
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], SALES_COLUMNS)
+        self.assertEqual(len(rows), 11)
+        first = dict(zip(rows[0], rows[1]))
+        self.assertEqual(first['order_date'][:10], '2025-01-01')
+        self.assertEqual((first['line_total'], first['return_status'], first['refund_amount']), ('20.00', 'pending', ''))
+
+    def test_parquet_export_needs_pyarrow(self):
+        with mock.patch('shop.views.parquet_available', return_value=False):
+            response = self.client.get(reverse('seller_sales_export'), {'format': 'parquet'})
+        self.assertRedirects(response, reverse('seller_dashboard'), fetch_redirect_response=False)
+
+    @skipUnless(parquet_available(), 'pyarrow is not installed')
+    def test_parquet_export(self):
+        import pyarrow.parquet as pq
+
+        response = self.client.get(reverse('seller_sales_export'), {'format': 'parquet'})
+        table = pq.read_table(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(table.column_names, SALES_COLUMNS)
+        self.assertEqual(table.num_rows, 30)
+
+
+class OrderHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seller = User.objects.create_user(username='seller', password='pass')
+        cls.customer = User.objects.create_user(username='customer', password='pass')
+        Profile.objects.create(user=cls.customer)
+        products = [
+            Product.objects.create(name=f'Thing {i}', description='', price=Decimal('3.00'), stock=5, seller=seller)
+            for i in range(3)
+        ]
+        start = timezone.make_aware(datetime.datetime(2025, 1, 1))
+        for day in range(15):
+            order = Order.objects.create(
+                customer=cls.customer, total_price=Decimal('9.00'), address='x', phone='1',
+                date=start + datetime.timedelta(days=day), status='delivered',
+            )
+            for product in products:
+                OrderItem.objects.create(order=order, product=product, quantity=1, price=Decimal('3.00'))
+            ReturnRequest.objects.create(order=order, reason='Too small')
+
+    def test_history_is_paginated_with_constant_queries(self):
+        cache.clear()
+        self.client.force_login(self.customer)
+        # user + profile and cart summary (cold cache), orders, items + products, return requests
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('order_history'))
+        orders = response.context['orders']
+        self.assertEqual(len(orders), 10)
+        self.assertEqual(orders.object_list[0].date.day, 15)
+
+        response = self.client.get(reverse('order_history'), {'cursor': orders.next_cursor})
+        self.assertEqual(len(response.context['orders']), 5)
+        self.assertFalse(response.context['orders'].has_next())
+
+
+def full_table_scans(queries):
+    """Tables that EXPLAIN QUERY PLAN reads without any index, per SELECT"""
+    scans = []
+    with connection.cursor() as cursor:
+        for query in queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+            details = [row[3] for row in cursor.fetchall()]
+            # Subqueries the planner materializes show up as "SCAN <name>" too
+            inner = {detail.split()[-1] for detail in details if detail.startswith(('CO-ROUTINE', 'MATERIALIZE'))}
+            for detail in details:
+                match = re.fullmatch(r'SCAN (\S+)', detail)
+                if match and match.group(1) not in inner:
+                    scans.append((match.group(1), query['sql']))
+    return scans
+
+
+class QueryPlanTests(TestCase):
+    """Every query behind the main pages must be served by an index"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='pass')
+        Profile.objects.create(user=cls.seller, user_type='seller')
+        cls.customer = User.objects.create_user(username='customer', password='pass')
+        Profile.objects.create(user=cls.customer)
+        cls.product = Product.objects.create(name='Mug', description='', price=Decimal('4.00'), stock=3, seller=cls.seller)
+        ProductImage.objects.create(product=cls.product, image='products/mug.jpg')
+        CartItem.objects.create(user=cls.customer, product=cls.product)
+        order = Order.objects.create(
+            customer=cls.customer, total_price=Decimal('4.00'), address='x', phone='1', date=timezone.now()
+        )
+        OrderItem.objects.create(order=order, product=cls.product, price=Decimal('4.00'))
+        ReturnRequest.objects.create(order=order, reason='Chipped')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_detects_full_scan(self):
+        with CaptureQueriesContext(connection) as context:
+            list(Product.objects.filter(description='x'))
+        self.assertEqual([table for table, sql in full_table_scans(context.captured_queries)], ['shop_product'])
+
+    def test_views_do_not_scan_tables(self):
+        pages = [
+            (None, reverse('home')),
+            (None, reverse('home') + '?sort=price_low&stock=in_stock'),
+            (None, reverse('home') + '?sort=name&min_price=1'),
+            (None, reverse('home') + '?search=mug'),
+            (None, reverse('product_detail', args=[self.product.pk])),
+            (self.customer, reverse('cart')),
+            (self.customer, reverse('checkout')),
+            (self.customer, reverse('order_history')),
+            (self.seller, reverse('seller_dashboard')),
+            (self.seller, reverse('seller_orders_page') + '?status=pending'),
+            (self.seller, reverse('seller_returns_page') + '?status=pending'),
+        ]
+        for user, url in pages:
+            with self.subTest(url=url):
+                self.client.logout()
+                if user:
+                    self.client.force_login(user)
+                with CaptureQueriesContext(connection) as context:
+                    self.assertEqual(self.client.get(url).status_code, 200)
+                self.assertEqual(full_table_scans(context.captured_queries), [])
+
+
+class CatalogReadRouterTests(TestCase):
+    def test_catalog_reads_use_read_connection_only_when_configured(self):
+        router = CatalogReadRouter()
+        with reading_catalog():
+            self.assertIsNone(router.db_for_read(Product))
+        with mock.patch.dict(settings.DATABASES, {'catalog_read': {}}):
+            self.assertIsNone(router.db_for_read(Product))
+            with reading_catalog():
+                self.assertEqual(router.db_for_read(Product), 'catalog_read')
+                self.assertEqual(router.db_for_write(Product), 'default')
+
+    def test_connection_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+
+class BenchmarkCommandTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+    def test_seed_then_benchmark_every_route(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            call_command('seed_shop', sellers=2, products=20, customers=3, orders=40, returns=5, stdout=StringIO())
+            self.assertEqual(Product.objects.count(), 20)
+            self.assertEqual(CartItem.objects.count(), 9)
+            self.assertEqual(ProductSearchIndex.objects.count(), 20)
+
+            output = os.path.join(self.media_root, 'bench.json')
+            call_command('benchmark_views', iterations=1, warmup=0, output=output, stdout=StringIO())
+            # GET handlers that change data were rolled back
+            self.assertEqual(CartItem.objects.count(), 9)
+
+        with open(output) as results:
+            views = json.load(results)['views']
+        self.assertEqual(set(views), {pattern.name for pattern in shop_urls.urlpatterns})
+        for name, result in views.items():
+            self.assertLess(result['status'], 500, name)
+        self.assertGreater(views['home']['bytes'], 0)
+        self.assertEqual(views['seller_sales_export']['status'], 200)
+        self.assertGreater(views['seller_sales_export']['bytes'], 0)
+
+
+class RequestMetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='ops', password='pass', is_staff=True)
+        Product.objects.create(name='Mug', description='', price=Decimal('4.00'), stock=3, seller=cls.staff)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_server_timing_and_histograms(self):
+        before = metrics.request_duration.count(route='home', method='GET')
+        response = self.client.get(reverse('home'))
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="3 queries"')
+        self.assertRegex(timing, r'tpl;dur=[\d.]+, total;dur=[\d.]+')
+        self.assertEqual(metrics.request_duration.count(route='home', method='GET'), before + 1)
+
+        # Served from the page cache: no SQL, no templates
+        response = self.client.get(reverse('home'))
+        self.assertIn('db;dur=0.0;desc="0 queries", tpl;dur=0.0', response['Server-Timing'])
+
+    async def test_queries_are_counted_under_asgi(self):
+        # The views' ORM calls run in sync_to_async threads, not the
+        # middleware's own
+        await self.async_client.aforce_login(self.staff)
+        for url in (reverse('home'), reverse('order_history')):
+            response = await self.async_client.get(url)
+            queries = int(re.search(r'desc="(\d+) queries"', response['Server-Timing']).group(1))
+            self.assertGreater(queries, 0, url)
+
+    def test_histogram_exposition(self):
+        histogram = metrics.Histogram('test_latency_seconds', 'Test', ['route'], buckets=(0.1, 1))
+        self.addCleanup(metrics._registry.remove, histogram)
+        for value in (0.05, 0.1, 3):
+            histogram.observe(value, route='home')
+        self.assertEqual(histogram.render()[2:], [
+            'test_latency_seconds_bucket{route="home",le="0.1"} 2',
+            'test_latency_seconds_bucket{route="home",le="1"} 2',
+            'test_latency_seconds_bucket{route="home",le="+Inf"} 3',
+            'test_latency_seconds_sum{route="home"} 3.15',
+            'test_latency_seconds_count{route="home"} 3',
+        ])
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_metrics_endpoint_access(self):
+        self.client.get(reverse('home'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertContains(response, 'shop_request_duration_seconds_bucket{route="home",method="GET",le="0.005"}')
+
+        self.client.force_login(self.staff)
+        self.assertContains(self.client.get(reverse('metrics')), '# TYPE shop_request_queries histogram')
+
+
+class ProductImportExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='bulk', password='pass')
+        Profile.objects.create(user=cls.seller, user_type='seller')
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.source_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source_dir)
+        Image.new('RGB', (700, 700), 'blue').save(os.path.join(self.source_dir, 'lamp.jpg'))
+        with open(os.path.join(self.source_dir, 'broken.jpg'), 'wb') as broken:
+            broken.write(b'not an image')
+
+    def write(self, name, content):
+        path = os.path.join(self.source_dir, name)
+        with open(path, 'w') as output:
+            output.write(content)
+        return path
+
+    def test_import_csv_then_export_jsonl(self):
+        path = self.write('catalog.csv', (
+            'name,description,price,stock,images\n'
+            'Desk Lamp,Warm light,19.99,4,lamp.jpg\n'
+            'No Price,,abc,1,\n'
+            'Broken Mug,,5,1,lamp.jpg|broken.jpg\n'
+            'Plain Box,,2.5,0,\n'
+        ))
+        errors = StringIO()
+        call_command('import_products', path, seller='bulk', images_dir=self.source_dir, batch_size=2,
+                     stdout=StringIO(), stderr=errors)
+        self.assertIn('Line 3: price and stock must be numbers', errors.getvalue())
+        self.assertIn('Line 4: bad image', errors.getvalue())
+
+        lamp, box = Product.objects.filter(seller=self.seller).order_by('id')
+        self.assertEqual((lamp.name, lamp.price, lamp.stock, box.price), ('Desk Lamp', Decimal('19.99'), 4, Decimal('2.50')))
+        image = lamp.images.get()
+        self.assertEqual((image.width, image.height), (700, 700))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, rendition_name(image.image.name, 640, 'webp'))))
+        # Only the lamp's image (plus renditions) made it into media
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'products'))), 2)
+        self.assertEqual(search_products(Product.objects.all(), 'lamp').get(), lamp)
+
+        output = os.path.join(self.source_dir, 'export.jsonl')
+        call_command('export_products', seller='bulk', format='jsonl', output=output, chunk_size=1, stdout=StringIO())
+        with open(output) as exported:
+            rows = [json.loads(line) for line in exported]
+        self.assertEqual([row['name'] for row in rows], ['Desk Lamp', 'Plain Box'])
+        self.assertEqual(rows[0]['images'], [image.image.name])
+        self.assertEqual(rows[0]['price'], '19.99')
+
+    def test_non_finite_prices_are_bad_rows(self):
+        path = self.write('catalog.jsonl', '\n'.join([
+            '{"name": "Ghost", "price": "NaN", "stock": 1}',
+            '{"name": "Priceless", "price": "Infinity", "stock": 1}',
+            '{"name": "Lamp", "price": "3", "stock": 1}',
+        ]))
+        errors = StringIO()
+        call_command('import_products', path, seller='bulk', stdout=StringIO(), stderr=errors)
+        self.assertIn('Line 1: price and stock must be numbers', errors.getvalue())
+        self.assertIn('Line 2: price and stock must be numbers', errors.getvalue())
+        self.assertEqual(list(Product.objects.values_list('name', flat=True)), ['Lamp'])
+
+
+class JobQueueTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.jobs_finished.clear()
+        self.seller = User.objects.create_user(username='seller', password='pass')
+        Profile.objects.create(user=self.seller, user_type='seller')
+        self.client.force_login(self.seller)
+
+    def run_worker(self):
+        call_command('run_worker', '--burst', '--concurrency', '2', stdout=StringIO(), stderr=StringIO())
+
+    def test_uploaded_images_are_rendered_by_the_worker(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        upload = BytesIO()
+        Image.new('RGB', (800, 400), 'red').save(upload, 'PNG')
+        upload.name = 'shoe.png'
+        upload.seek(0)
+
+        with override_settings(MEDIA_ROOT=media_root):
+            self.client.post(reverse('add_product'), {
+                'name': 'Shoe', 'description': '', 'price': '10.00', 'stock': '1', 'images': [upload],
+            })
+            image = ProductImage.objects.get()
+            self.assertIsNone(image.width)
+            self.assertEqual(Job.objects.get().name, 'render_product_image')
+            self.run_worker()
+
+        image.refresh_from_db()
+        self.assertEqual((image.width, image.height), (800, 400))
+        self.assertTrue(os.path.exists(os.path.join(media_root, rendition_name(image.image.name, 640, 'webp'))))
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+
+    def test_failing_job_is_retried_with_backoff_then_failed(self):
+        def flaky():
+            raise RuntimeError('upstream down')
+
+        with mock.patch.dict(jobs._handlers, {'flaky': flaky}):
+            job = jobs.enqueue('flaky', max_attempts=2)
+            self.run_worker()
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+            self.assertGreater(job.run_at, timezone.now())
+            self.assertEqual(job.last_error, 'RuntimeError: upstream down')
+
+            Job.objects.update(run_at=timezone.now())
+            self.run_worker()
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+        self.assertEqual(metrics.jobs_finished.value(job='flaky', outcome='retry'), 1)
+        self.assertEqual(metrics.jobs_finished.value(job='flaky', outcome='failed'), 1)
+
+    def test_status_change_emails_customer_once(self):
+        customer = User.objects.create_user(username='customer', password='pass', email='c@example.com')
+        product = Product.objects.create(name='Mug', description='', price=Decimal('4.00'), stock=5, seller=self.seller)
+        order = Order.objects.create(customer=customer, total_price=Decimal('4.00'), address='Here', phone='1')
+        OrderItem.objects.create(order=order, product=product, price=Decimal('4.00'))
+
+        for _ in range(2):
+            self.client.post(reverse('update_order_status', args=[order.pk]), {'status': 'shipped'})
+        self.assertEqual(Job.objects.count(), 1)
+        self.run_worker()
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['c@example.com'])
+        self.assertIn('Order #%d: Shipped' % order.pk, mail.outbox[0].subject)
+
+        # Going back and shipping again is a new change, so it notifies again
+        for status in ('processing', 'shipped'):
+            self.client.post(reverse('update_order_status', args=[order.pk]), {'status': status})
+            self.run_worker()
+        self.assertEqual([message.subject for message in mail.outbox[1:]], [
+            'Order #%d: Processing' % order.pk, 'Order #%d: Shipped' % order.pk,
+        ])
+
+        # Enqueueing the same change again (a retry) adds nothing
+        order.refresh_from_db()
+        queue_order_notification(order)
+        self.assertEqual(Job.objects.count(), 3)
+
+    def test_return_actions_notify_and_restock_once(self):
+        customer = User.objects.create_user(username='customer', password='pass', email='c@example.com')
+        product = Product.objects.create(name='Mug', description='', price=Decimal('4.00'), stock=5, seller=self.seller)
+        order = Order.objects.create(customer=customer, total_price=Decimal('4.00'), address='Here', phone='1')
+        OrderItem.objects.create(order=order, product=product, price=Decimal('4.00'))
+        return_request = ReturnRequest.objects.create(order=order, reason='Broken')
+
+        url = reverse('handle_return_request', args=[return_request.pk])
+        for action in ('approve', 'approve', 'item_received', 'item_received'):
+            self.client.post(url, {'action': action})
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 6)
+        self.assertEqual(sorted(Job.objects.values_list('idempotency_key', flat=True)), [
+            f'return-status:{return_request.pk}:1:approved', f'return-status:{return_request.pk}:2:item_received',
+        ])
+
+
+class StockHoldTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seller = User.objects.create_user(username='seller', password='pass')
+        cls.product = Product.objects.create(name='Sneaker', description='', price=Decimal('50.00'), stock=2, seller=seller)
+        cls.alice, cls.bob = [User.objects.create_user(username=name, password='pass') for name in ('alice', 'bob')]
+
+    def setUp(self):
+        cache.clear()
+
+    def add_to_cart(self, user):
+        self.client.force_login(user)
+        return self.client.get(reverse('add_to_cart', args=[self.product.pk]), follow=True)
+
+    def assertStock(self, expected):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, expected)
+        # The ledger accounts for every unit that left or came back
+        moved = sum(StockMovement.objects.filter(product=self.product).values_list('change', flat=True))
+        self.assertEqual(2 + moved, expected)
+
+    def test_cart_holds_units_until_checkout(self):
+        self.add_to_cart(self.alice)
+        self.add_to_cart(self.bob)
+        self.assertStock(0)
+        self.assertContains(self.add_to_cart(self.bob), 'Only 1 items available')
+        self.assertEqual(CartItem.objects.get(user=self.bob).quantity, 1)
+
+        order = Order.place_from_cart(self.alice, 'Here', '1')
+        self.assertStock(0)
+        self.assertFalse(StockHold.objects.filter(user=self.alice).exists())
+        self.assertEqual(StockMovement.objects.get(order=order).reason, 'sale')
+
+        self.client.force_login(self.bob)
+        self.client.get(reverse('remove_from_cart', args=[CartItem.objects.get(user=self.bob).pk]))
+        self.assertStock(1)
+
+    def test_lapsed_holds_are_returned(self):
+        self.add_to_cart(self.alice)
+        self.add_to_cart(self.alice)
+        StockHold.objects.update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+
+        # Someone else asking for the units reclaims them straight away
+        self.add_to_cart(self.bob)
+        self.assertStock(1)
+        self.assertEqual(StockHold.objects.get().user, self.bob)
+        self.assertEqual(StockMovement.objects.filter(reason='expire').get().change, 2)
+
+        # Alice's cart is still there, but checkout now needs free stock
+        with self.assertRaises(InsufficientStock):
+            Order.place_from_cart(self.alice, 'Here', '1')
+
+        StockHold.objects.update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(expire_holds(batch_size=1), 1)
+        self.assertStock(2)
+
+    def test_cancel_restocks_once(self):
+        self.add_to_cart(self.alice)
+        order = Order.place_from_cart(self.alice, 'Here', '1')
+        self.assertStock(1)
+        for _ in range(2):
+            self.client.get(reverse('cancel_order', args=[order.pk]))
+        self.assertStock(2)
+        self.assertEqual(StockMovement.objects.filter(reason='cancel').count(), 1)
+
+    def versions(self):
+        return catalog_version(), product_versions([self.product.pk])[self.product.pk]
+
+    def test_listings_are_retired_only_when_stock_runs_out(self):
+        catalog, product = self.versions()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_to_cart(self.alice)
+        self.assertEqual(self.versions()[0], catalog)
+        self.assertNotEqual(self.versions()[1], product)
+
+        # The last unit going into a cart takes the product out of stock
+        catalog = self.versions()[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_to_cart(self.bob)
+        self.assertNotEqual(self.versions()[0], catalog)
+
+
+class RecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(username='buyer', password='pass')
+        cls.mug, cls.tea, cls.spoon, cls.lamp = [
+            Product.objects.create(name=name, description='', price=Decimal('5.00'), stock=10, seller=cls.customer)
+            for name in ('Mug', 'Tea', 'Spoon', 'Lamp')
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def order(self, *products, status='pending'):
+        order = Order.objects.create(
+            customer=self.customer, total_price=Decimal('5.00'), address='Here', phone='1', status=status
+        )
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+        return order
+
+    def recommended(self, product):
+        return [
+            (item.name, item.score)
+            for item in Product.objects.bought_with(product).annotate(score=F('recommended_for__score'))
+        ]
+
+    def test_cooccurrence_counts_pairs_in_both_directions(self):
+        baskets = np.array([[1, 10], [1, 20], [1, 30], [2, 10], [2, 20], [3, 40]])
+        pairs = sorted(zip(*(column.tolist() for column in cooccurrence(baskets))))
+        self.assertEqual(pairs, [
+            (10, 20, 2), (10, 30, 1), (20, 10, 2), (20, 30, 1), (30, 10, 1), (30, 20, 1),
+        ])
+
+    def test_incremental_updates_match_a_full_rebuild(self):
+        self.order(self.mug, self.tea, self.spoon)
+        self.order(self.mug, self.tea)
+        self.order(self.mug, self.lamp, status='cancelled')
+        build = update_recommendations()
+        self.assertEqual((build.orders, build.products), (2, 3))
+        self.assertEqual(self.recommended(self.mug), [('Tea', 2), ('Spoon', 1)])
+
+        self.order(self.mug, self.spoon)
+        self.order(self.mug, self.spoon)
+        build = update_recommendations(top_k=1)
+        self.assertEqual((build.orders, build.products), (2, 2))
+        self.assertEqual(self.recommended(self.mug), [('Spoon', 3)])
+        # Tea wasn't in the new orders, so its recommendations stand
+        self.assertEqual(self.recommended(self.tea), [('Mug', 2), ('Spoon', 1)])
+
+        incremental = set(ProductPair.objects.values_list('product', 'other', 'count'))
+        update_recommendations(full=True)
+        self.assertEqual(set(ProductPair.objects.values_list('product', 'other', 'count')), incremental)
+
+    def test_product_detail_shows_recommendations(self):
+        self.order(self.mug, self.tea)
+        call_command('rebuild_recommendations', stdout=StringIO())
+        response = self.client.get(reverse('product_detail', args=[self.mug.pk]))
+        self.assertContains(response, 'Frequently Bought Together')
+        self.assertContains(response, reverse('product_detail', args=[self.tea.pk]))
+
+    def test_new_orders_reach_cached_product_pages(self):
+        self.order(self.mug, self.tea)
+        call_command('rebuild_recommendations', stdout=StringIO())
+        url = reverse('product_detail', args=[self.mug.pk])
+        self.assertNotContains(self.client.get(url), reverse('product_detail', args=[self.lamp.pk]))
+        self.assertIsNone(refresh_recommendations())
+
+        self.order(self.mug, self.lamp)
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh_recommendations()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, reverse('product_detail', args=[self.lamp.pk]))
@@ -0,0 +1,61 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .locks import host_lock
+
+
+# Token-bucket rate limits
+#
+# Each (scope, key) pair - say, login attempts from one IP - has a bucket of
+# up to `capacity` tokens that refills by one every `refill_seconds`
+# (THROTTLE_RATES). Every attempt spends a token; with none left the attempt
+# is refused. Buckets live in the shared cache as (tokens, last update), so
+# every worker process on the host draws from the same one, and a bucket
+# nobody touches simply expires once it would be full again.
+#
+# Spending happens under a host-wide lock (shop.locks); otherwise a burst of
+# parallel attempts could all read the same count.
+
+class Throttled(Exception):
+    def __init__(self, scope, wait):
+        self.scope = scope
+        self.wait = wait
+        super().__init__(f'{scope} limit reached; retry in {wait:.0f}s')
+
+
+def _cache_key(scope, key):
+    return f'throttle:{scope}:{hashlib.md5(key.encode()).hexdigest()}'
+
+
+def take(*buckets):
+    """Spend one token from each (scope, key) bucket, or from none of them.
+
+    Raises Throttled (for the bucket with the longest wait) if any is empty;
+    then nothing is spent.
+    """
+    with host_lock('throttle'):
+        now = time.time()
+        found = cache.get_many([_cache_key(scope, key) for scope, key in buckets])
+        updates, refused = {}, None
+        for scope, key in buckets:
+            capacity, refill_seconds = settings.THROTTLE_RATES[scope]
+            cache_key = _cache_key(scope, key)
+            tokens, updated_at = found.get(cache_key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) / refill_seconds)
+            if tokens < 1:
+                wait = (1 - tokens) * refill_seconds
+                if refused is None or wait > refused.wait:
+                    refused = Throttled(scope, wait)
+            updates[cache_key] = ((tokens - 1, now), int(capacity * refill_seconds) + 1)
+        if refused is not None:
+            raise refused
+        for cache_key, (bucket, timeout) in updates.items():
+            cache.set(cache_key, bucket, timeout)
+
+
+def reset(scope, key):
+    """Refill `key`'s bucket, e.g. once a login has succeeded"""
+    cache.delete(_cache_key(scope, key))
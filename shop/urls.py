@@ -5,6 +5,7 @@ urlpatterns = [
     # Home and Products
     path('', views.home, name='home'),
     path('product/<int:product_id>/', views.product_detail, name='product_detail'),
+    path('search/suggest/', views.search_suggest, name='search_suggest'),
     
     # Authentication
     path('register/', views.register_page, name='register'),
@@ -27,6 +28,9 @@ urlpatterns = [
     
     # Seller Dashboard
     path('seller/dashboard/', views.seller_dashboard, name='seller_dashboard'),
+    path('seller/dashboard/orders/', views.seller_orders_page, name='seller_orders_page'),
+    path('seller/dashboard/returns/', views.seller_returns_page, name='seller_returns_page'),
+    path('seller/dashboard/export/', views.seller_sales_export, name='seller_sales_export'),
     path('seller/add-product/', views.add_product, name='add_product'),
     path('seller/edit-product/<int:product_id>/', views.edit_product, name='edit_product'),
     path('seller/delete-product/<int:product_id>/', views.delete_product, name='delete_product'),
@@ -34,5 +38,8 @@ urlpatterns = [
     path('seller/handle-return/<int:request_id>/', views.handle_return_request, name='handle_return_request'),
     path('seller/delete-product-image/<int:image_id>/', views.delete_product_image, name='delete_product_image'),
     path('seller/reorder-product-images/<int:product_id>/', views.reorder_product_images, name='reorder_product_images'),
+    
+    # Monitoring
+    path('metrics/', views.metrics, name='metrics'),
 
 ]
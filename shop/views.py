@@ -1,69 +1,132 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
-from django.db import models
-from .models import Product, CartItem, Order, OrderItem, Profile, ProductImage, ReturnRequest
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.db import models, transaction
+from django.db.models import Prefetch
+from . import throttle
+from .models import Product, CartItem, Order, OrderItem, Profile, ProductImage, ReturnRequest, SellerStats, EmptyCart, InsufficientStock
+from .auth import customer_required, is_seller, seller_required
+from .cart import aget_cart_summary, get_cart_summary
+from .facets import afacet_counts, filter_q, parse_filters
+from .exports import csv_chunks, parquet_available, sales_rows, write_parquet
+from .inventory import adjust_stock, hold_stock, release_stock, restock_order
+from .metrics import login_attempts, login_throttled, render_metrics
+from .page_cache import CATALOG_VERSION_KEY, anonymous_page_cache, product_version_key
+from .pagination import InvalidCursor, KeysetPaginator, aapproximate_count
+from .routers import catalog_read
+from .search import search_products
+from .suggest import asuggest
+from .tasks import queue_image_renditions, queue_order_notification, queue_return_notification
 import json
+import math
+import tempfile
+
+
+CATALOG_PAGE_SIZE = 24
+SELLER_TABLE_PAGE_SIZE = 25
+ORDER_HISTORY_PAGE_SIZE = 10
+
+# Sort options for the catalog; ties are broken on id by the paginator
+CATALOG_SORTS = {
+    'price_low': 'price',
+    'price_high': '-price',
+    'name': 'name',
+    'newest': '-created_at',
+}
+
+
+# Async views (home, product_detail, view_cart) load their data with the
+# async ORM, then render in a worker thread: templates are sync code and the
+# navbar still reads the session, user and cart badge through the sync ORM.
+arender = sync_to_async(render)
+
+
+def _without_cursor(request):
+    """Redirect to the same listing from its first page, for a cursor that no
+    longer applies (malformed, or from another sort order)"""
+    query = request.GET.copy()
+    query.pop('cursor', None)
+    return redirect(f'{request.path}?{query.urlencode()}' if query else request.path)
+
 
 
 # Home page - Product listing with search and filters
-def home(request):
-    products = Product.objects.all()
-    
-    # Search functionality
-    search_query = request.GET.get('search', '')
+@anonymous_page_cache(lambda request: [CATALOG_VERSION_KEY])
+@catalog_read
+async def home(request):
+    filters = parse_filters(request.GET)
+    products = Product.objects.with_card_data()
+    
+    # Search functionality (full-text, ranked by relevance)
+    search_query = filters['search']
     if search_query:
-        products = products.filter(name__icontains=search_query)
+        products = search_products(products, search_query)
     
-    # Price filter
-    min_price = request.GET.get('min_price', '')
-    max_price = request.GET.get('max_price', '')
-    
-    if min_price:
-        products = products.filter(price__gte=min_price)
-    if max_price:
-        products = products.filter(price__lte=max_price)
-    
-    # Stock filter
-    stock_filter = request.GET.get('stock', '')
-    if stock_filter == 'in_stock':
-        products = products.filter(stock__gt=0)
-    elif stock_filter == 'out_of_stock':
-        products = products.filter(stock=0)
+    # Price, stock and seller filters
+    products = products.filter(filter_q(filters))
     
     # Sorting
     sort_by = request.GET.get('sort', '')
-    if sort_by == 'price_low':
-        products = products.order_by('price')
-    elif sort_by == 'price_high':
-        products = products.order_by('-price')
-    elif sort_by == 'name':
-        products = products.order_by('name')
-    elif sort_by == 'newest':
-        products = products.order_by('-created_at')
+    if search_query:
+        default_ordering = 'search_rank'  # Default: best match first
     else:
-        products = products.order_by('-created_at')  # Default: newest first
+        default_ordering = '-created_at'  # Default: newest first
+    ordering = CATALOG_SORTS.get(sort_by, default_ordering)
+    
+    product_count, product_count_capped = await aapproximate_count(products)
+    facets = await afacet_counts(filters)
+    
+    paginator = KeysetPaginator(products, ordering, per_page=CATALOG_PAGE_SIZE)
+    try:
+        page = await paginator.apage(request.GET.get('cursor'))
+    except InvalidCursor:
+        return _without_cursor(request)
     
     context = {
-        'products': products,
+        'products': page.object_list,
+        'page': page,
+        'product_count': product_count,
+        'product_count_capped': product_count_capped,
+        'facets': facets,
         'search_query': search_query,
-        'min_price': min_price,
-        'max_price': max_price,
-        'stock_filter': stock_filter,
+        'min_price': '' if filters['min_price'] is None else filters['min_price'],
+        'max_price': '' if filters['max_price'] is None else filters['max_price'],
+        'stock_filter': filters['stock'],
+        'seller_filter': filters['seller'],
         'sort_by': sort_by,
     }
     
-    return render(request, 'home.html', context)
+    return await arender(request, 'home.html', context)
 
 
 
 # Product detail page
-def product_detail(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    return render(request, 'product_detail.html', {'product': product})
+@anonymous_page_cache(lambda request, product_id: [product_version_key(product_id)])
+@catalog_read
+async def product_detail(request, product_id):
+    product = await aget_object_or_404(Product.objects.with_images().select_related('seller'), id=product_id)
+    recommendations = [item async for item in Product.objects.with_card_data().bought_with(product)]
+    return await arender(request, 'product_detail.html', {'product': product, 'recommendations': recommendations})
+
+
+# Typeahead suggestions for the search box
+async def search_suggest(request):
+    suggestions = await asuggest(request.GET.get('q', ''))
+    return JsonResponse({
+        'suggestions': [
+            {'id': pk, 'name': name, 'url': reverse('product_detail', args=[pk])} for pk, name in suggestions
+        ],
+    })
 
 
 # User registration
@@ -104,22 +167,32 @@ def register_page(request):
 # User login
 def login_page(request):
     if request.method == 'POST':
-        username = request.POST.get('username')
-        password = request.POST.get('password')
-        
-        if not User.objects.filter(username=username).exists():
-            messages.error(request, 'Invalid username')
-            return redirect('login')
-        
-        user = authenticate(username=username, password=password)
+        username = request.POST.get('username', '')
+        password = request.POST.get('password', '')
+        
+        # Refuse excess attempts before paying for the password hash
+        try:
+            throttle.take(('login-ip', request.META.get('REMOTE_ADDR', '')), ('login-username', username.lower()))
+        except throttle.Throttled as exc:
+            login_throttled.inc(scope=exc.scope)
+            login_attempts.inc(outcome='throttled')
+            messages.error(request, f'Too many login attempts. Please try again in {math.ceil(exc.wait)} seconds.')
+            response = render(request, 'login.html', status=429)
+            response['Retry-After'] = str(math.ceil(exc.wait))
+            return response
+        
+        user = authenticate(request, username=username, password=password)
         
         if user is None:
-            messages.error(request, 'Invalid password')
+            login_attempts.inc(outcome='failure')
+            messages.error(request, 'Invalid username or password')
             return redirect('login')
         else:
+            login_attempts.inc(outcome='success')
+            throttle.reset('login-username', username.lower())
             login(request, user)
             
-            if hasattr(user, 'profile') and user.profile.is_seller():
+            if is_seller(user):
                 return redirect('seller_dashboard')
             return redirect('home')
     
@@ -134,28 +207,28 @@ def logout_view(request):
 
 # Add to cart
 @login_required(login_url='login')
+@customer_required('Sellers cannot purchase products. Please register as a customer.')
 def add_to_cart(request, product_id):
-    if hasattr(request.user, 'profile') and request.user.profile.is_seller():
-        messages.error(request, 'Sellers cannot purchase products. Please register as a customer.')
-        return redirect('home')
-    
     product = get_object_or_404(Product, id=product_id)
-    
-    if product.stock <= 0:
-        messages.error(request, f'Sorry! {product.name} is out of stock.')
-        return redirect('product_detail', product_id=product_id)
-    
-    cart_item, created = CartItem.objects.get_or_create(
-        user=request.user,
-        product=product
-    )
-    
-    if not created:
-        if cart_item.quantity + 1 > product.stock:
-            messages.error(request, f'Sorry! Only {product.stock} items available.')
-            return redirect('cart')
-        cart_item.quantity += 1
-        cart_item.save()
+    cart_item = None
+    
+    # Reserve the units as they go into the cart, so checkout can't come up short
+    try:
+        with transaction.atomic():
+            # Read the line under the write lock, so two adds at once can't
+            # both count from the same quantity
+            cart_item = CartItem.objects.select_for_update().filter(user=request.user, product=product).first()
+            quantity = cart_item.quantity + 1 if cart_item else 1
+            hold_stock(request.user, product, quantity)
+            CartItem.objects.update_or_create(user=request.user, product=product, defaults={'quantity': quantity})
+    except InsufficientStock:
+        if not cart_item:
+            messages.error(request, f'Sorry! {product.name} is out of stock.')
+            return redirect('product_detail', product_id=product_id)
+        product.refresh_from_db(fields=['stock'])
+        available = product.stock + CartItem.objects.with_holds().get(pk=cart_item.pk).held
+        messages.error(request, f'Sorry! Only {available} items available.')
+        return redirect('cart')
     
     messages.success(request, f'{product.name} added to cart!')
     return redirect('cart')
@@ -163,28 +236,30 @@ def add_to_cart(request, product_id):
 
 # View cart
 @login_required(login_url='login')
-def view_cart(request):
-    if hasattr(request.user, 'profile') and request.user.profile.is_seller():
-        messages.error(request, 'Sellers cannot access cart. Please use Seller Dashboard.')
-        return redirect('seller_dashboard')
-    
-    cart_items = CartItem.objects.filter(user=request.user)
-    total = sum(item.get_total() for item in cart_items)
-    return render(request, 'cart.html', {'cart_items': cart_items, 'total': total})
+@customer_required('Sellers cannot access cart. Please use Seller Dashboard.', redirect_to='seller_dashboard')
+async def view_cart(request):
+    cart_items = [item async for item in CartItem.objects.filter(user=request.user).with_products().with_holds()]
+    total = (await aget_cart_summary(request.user))['subtotal']
+    return await arender(request, 'cart.html', {'cart_items': cart_items, 'total': total})
 
 
 # Update cart
 @login_required(login_url='login')
 def update_cart(request, item_id):
     if request.method == 'POST':
-        cart_item = get_object_or_404(CartItem, id=item_id, user=request.user)
-        quantity = int(request.POST.get('quantity', 1))
-        
-        if quantity > 0:
-            cart_item.quantity = quantity
-            cart_item.save()
-        else:
-            cart_item.delete()
+        cart_item = get_object_or_404(CartItem.objects.select_related('product'), id=item_id, user=request.user)
+        quantity = max(int(request.POST.get('quantity', 1)), 0)
+        
+        try:
+            with transaction.atomic():
+                hold_stock(request.user, cart_item.product, quantity)
+                if quantity > 0:
+                    cart_item.quantity = quantity
+                    cart_item.save()
+                else:
+                    cart_item.delete()
+        except InsufficientStock:
+            messages.error(request, f'Sorry! Not enough {cart_item.product.name} in stock.')
     
     return redirect('cart')
 
@@ -192,66 +267,52 @@ def update_cart(request, item_id):
 # Remove from cart
 @login_required(login_url='login')
 def remove_from_cart(request, item_id):
-    cart_item = get_object_or_404(CartItem, id=item_id, user=request.user)
-    cart_item.delete()
+    cart_item = get_object_or_404(CartItem.objects.select_related('product'), id=item_id, user=request.user)
+    with transaction.atomic():
+        release_stock(request.user, cart_item.product)
+        cart_item.delete()
     messages.success(request, 'Item removed from cart!')
     return redirect('cart')
 
 
 # Checkout
 @login_required(login_url='login')
+@customer_required('Sellers cannot place orders.', redirect_to='seller_dashboard')
 def checkout(request):
-    if hasattr(request.user, 'profile') and request.user.profile.is_seller():
-        messages.error(request, 'Sellers cannot place orders.')
-        return redirect('seller_dashboard')
-    
-    cart_items = CartItem.objects.filter(user=request.user)
+    summary = get_cart_summary(request.user)
     
-    if not cart_items.exists():
+    if not summary['item_count']:
         messages.error(request, 'Your cart is empty!')
         return redirect('cart')
     
-    total = sum(item.get_total() for item in cart_items)
-    
     if request.method == 'POST':
         address = request.POST.get('address')
         phone = request.POST.get('phone')
         
-        for cart_item in cart_items:
-            if cart_item.product.stock < cart_item.quantity:
-                messages.error(request, f'Sorry! {cart_item.product.name} has only {cart_item.product.stock} items in stock.')
-                return redirect('cart')
-        
-        order = Order.objects.create(
-            customer=request.user,
-            total_price=total,
-            address=address,
-            phone=phone
-        )
-        
-        for cart_item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                quantity=cart_item.quantity,
-                price=cart_item.product.price
-            )
-            
-            cart_item.product.stock -= cart_item.quantity
-            cart_item.product.save()
-        
-        cart_items.delete()
+        try:
+            order = Order.place_from_cart(request.user, address, phone)
+        except EmptyCart:
+            messages.error(request, 'Your cart is empty!')
+            return redirect('cart')
+        except InsufficientStock as exc:
+            product = Product.objects.get(pk=exc.product.pk)
+            messages.error(request, f'Sorry! {product.name} has only {product.stock} items in stock.')
+            return redirect('cart')
         
         messages.success(request, 'Order placed successfully!')
         return redirect('order_confirmation', order_id=order.id)
     
-    return render(request, 'checkout.html', {'cart_items': cart_items, 'total': total})
+    cart_items = CartItem.objects.filter(user=request.user).with_products()
+    return render(request, 'checkout.html', {'cart_items': cart_items, 'total': summary['subtotal']})
 
 
 # Order confirmation
 @login_required(login_url='login')
 def order_confirmation(request, order_id):
-    order = get_object_or_404(Order, id=order_id, customer=request.user)
+    order = get_object_or_404(
+        Order.objects.prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('product'))),
+        id=order_id, customer=request.user
+    )
     return render(request, 'order_confirmation.html', {'order': order})
 
 
@@ -259,7 +320,12 @@ def order_confirmation(request, order_id):
 @login_required(login_url='login')
 def order_history(request):
     orders = Order.get_orders_by_customer(request.user.id)
-    return render(request, 'order_history.html', {'orders': orders})
+    paginator = KeysetPaginator(orders, '-date', per_page=ORDER_HISTORY_PAGE_SIZE)
+    try:
+        page = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return _without_cursor(request)
+    return render(request, 'order_history.html', {'orders': page})
 
 
 # Cancel Order
@@ -271,12 +337,16 @@ def cancel_order(request, order_id):
         messages.error(request, 'Cannot cancel order that has been shipped or delivered.')
         return redirect('order_history')
     
-    order.status = 'cancelled'
-    order.save()
-    
-    for item in order.items.all():
-        item.product.stock += item.quantity
-        item.product.save()
+    with transaction.atomic():
+        # Re-read under the write lock so a double submit can't restock twice
+        order.refresh_from_db(fields=['status'])
+        if order.status == 'cancelled':
+            messages.info(request, f'Order #{order.id} is already cancelled.')
+            return redirect('order_history')
+        with SellerStats.track(order):
+            order.status = 'cancelled'
+            order.save()
+        restock_order(order, 'cancel')
     
     messages.success(request, f'Order #{order.id} has been cancelled successfully.')
     return redirect('order_history')
@@ -328,67 +398,144 @@ def update_return_tracking(request, request_id):
 
 # Seller Dashboard
 @login_required(login_url='login')
+@seller_required()
 def seller_dashboard(request):
-    if not hasattr(request.user, 'profile') or not request.user.profile.is_seller():
-        messages.error(request, 'Access denied! Sellers only.')
-        return redirect('home')
+    products = Product.objects.filter(seller=request.user).with_card_data()
     
-    from decimal import Decimal
+    # Only the first page of orders is rendered here; further pages and the
+    # return requests table are fetched by the page as it scrolls
+    try:
+        orders = seller_orders_paginated(request)
+    except InvalidCursor:
+        return _without_cursor(request)
     
-    products = Product.objects.filter(seller=request.user)
-    orders = OrderItem.objects.filter(product__seller=request.user).select_related('order', 'product')
-    
-    return_requests = ReturnRequest.objects.filter(
-        order__items__product__seller=request.user
-    ).distinct().order_by('-created_at')
-    
-    total_refunded = Decimal('0.00')
-    refunded_order_ids = []
-    
-    for return_req in return_requests:
-        if return_req.status == 'refund_completed' and return_req.refund_amount:
-            total_refunded += Decimal(str(return_req.refund_amount))
-            refunded_order_ids.append(return_req.order.id)
-    
-    total_sales = Decimal('0.00')
-    for item in orders:
-        if item.order.id not in refunded_order_ids:
-            total_sales += Decimal(str(item.quantity)) * Decimal(str(item.price))
-    
-    total_products = products.count()
-    total_orders = orders.count()
+    # Header numbers come from the incrementally maintained rollup
+    stats = SellerStats.for_seller(request.user)
     
     context = {
         'products': products,
         'orders': orders,
-        'return_requests': return_requests,
-        'total_products': total_products,
-        'total_sales': total_sales,
-        'total_orders': total_orders,
-        'total_refunded': total_refunded,
+        'order_status_choices': Order.STATUS_CHOICES,
+        'return_status_choices': ReturnRequest.RETURN_STATUS_CHOICES,
+        'total_products': stats.total_products,
+        'total_sales': stats.total_sales,
+        'total_orders': stats.total_orders,
+        'total_refunded': stats.total_refunded,
     }
     
     return render(request, 'seller_dashboard.html', context)
 
 
+def _date_range_filter(queryset, request, field):
+    """Apply optional ?date_from=/?date_to= (YYYY-MM-DD, inclusive) to `field`"""
+    try:
+        date_from = parse_date(request.GET.get('date_from') or '')
+        date_to = parse_date(request.GET.get('date_to') or '')
+    except ValueError:
+        date_from = date_to = None
+    if date_from:
+        queryset = queryset.filter(**{f'{field}__date__gte': date_from})
+    if date_to:
+        queryset = queryset.filter(**{f'{field}__date__lte': date_to})
+    return queryset
+
+
+def _seller_order_lines(request):
+    """The seller's order lines, filtered by ?status= and the date range"""
+    lines = OrderItem.objects.filter(product__seller=request.user)
+    
+    status = request.GET.get('status')
+    if status:
+        lines = lines.filter(order__status=status)
+    return _date_range_filter(lines, request, 'order__date')
+
+
+def seller_orders_paginated(request):
+    lines = _seller_order_lines(request).select_related(
+        'order__customer', 'product'
+    ).annotate(order_date=models.F('order__date'))
+    
+    paginator = KeysetPaginator(lines, '-order_date', per_page=SELLER_TABLE_PAGE_SIZE)
+    return paginator.page(request.GET.get('cursor'))
+
+
+def seller_returns_paginated(request):
+    seller_orders = OrderItem.objects.filter(product__seller=request.user).values('order')
+    return_requests = ReturnRequest.objects.filter(order__in=seller_orders).select_related('order__customer')
+    
+    status = request.GET.get('status')
+    if status:
+        return_requests = return_requests.filter(status=status)
+    return_requests = _date_range_filter(return_requests, request, 'created_at')
+    
+    paginator = KeysetPaginator(return_requests, '-created_at', per_page=SELLER_TABLE_PAGE_SIZE)
+    return paginator.page(request.GET.get('cursor'))
+
+
+# Seller Dashboard - paginated order rows (JSON with an HTML fragment)
+@login_required(login_url='login')
+@seller_required(json=True)
+def seller_orders_page(request):
+    try:
+        page = seller_orders_paginated(request)
+    except InvalidCursor:
+        # Tell the table to reload from the top instead of appending rows
+        return JsonResponse({'status': 'error', 'reset': True}, status=400)
+    html = render_to_string('includes/seller_order_rows.html', {
+        'orders': page,
+        'first_page': not request.GET.get('cursor'),
+    }, request=request)
+    return JsonResponse({'html': html, 'next_cursor': page.next_cursor})
+
+
+# Seller Dashboard - paginated return request rows (JSON with an HTML fragment)
+@login_required(login_url='login')
+@seller_required(json=True)
+def seller_returns_page(request):
+    try:
+        page = seller_returns_paginated(request)
+    except InvalidCursor:
+        return JsonResponse({'status': 'error', 'reset': True}, status=400)
+    html = render_to_string('includes/seller_return_rows.html', {
+        'return_requests': page,
+        'first_page': not request.GET.get('cursor'),
+    }, request=request)
+    return JsonResponse({'html': html, 'next_cursor': page.next_cursor})
+
+
+# Seller Dashboard - download order lines and refunds (CSV or Parquet)
+@login_required(login_url='login')
+@seller_required()
+def seller_sales_export(request):
+    rows = sales_rows(_seller_order_lines(request))
+    filename = f'sales-{timezone.localdate():%Y-%m-%d}'
+    
+    if request.GET.get('format') == 'parquet':
+        if not parquet_available():
+            messages.error(request, 'Parquet export is not available on this server. Please download CSV instead.')
+            return redirect('seller_dashboard')
+        # Parquet's footer is written last, so build the file on disk first
+        output = tempfile.TemporaryFile()
+        write_parquet(rows, output)
+        output.seek(0)
+        return FileResponse(output, as_attachment=True, filename=f'{filename}.parquet',
+                            content_type='application/vnd.apache.parquet')
+    
+    response = StreamingHttpResponse(csv_chunks(rows), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
+
+
 # Add Product
 @login_required(login_url='login')
+@seller_required()
 def add_product(request):
-    if not hasattr(request.user, 'profile') or not request.user.profile.is_seller():
-        messages.error(request, 'Access denied! Sellers only.')
-        return redirect('home')
-    
     if request.method == 'POST':
         name = request.POST.get('name')
         description = request.POST.get('description')
         price = request.POST.get('price')
         stock = request.POST.get('stock')
         
-        print(f"\n=== ADD PRODUCT DEBUG ===")
-        print(f"Name: {name}")
-        print(f"Files in request: {request.FILES}")
-        print(f"Images: {request.FILES.getlist('images')}")
-        
         product = Product.objects.create(
             name=name,
             description=description,
@@ -398,15 +545,17 @@ def add_product(request):
         )
         
         images = request.FILES.getlist('images')
-        print(f"Total images to save: {len(images)}")
         
+        saved_images = []
         for index, image in enumerate(images):
-            ProductImage.objects.create(
+            saved_images.append(ProductImage.objects.create(
                 product=product,
                 image=image,
                 order=index
-            )
-            print(f"✓ Saved image {index + 1}: {image.name}")
+            ))
+        
+        # Resized renditions are generated by the job worker
+        queue_image_renditions(saved_images)
         
         messages.success(request, f'Product "{product.name}" added successfully with {len(images)} images!')
         return redirect('seller_dashboard')
@@ -423,16 +572,15 @@ def edit_product(request, product_id):
         product.name = request.POST.get('name')
         product.description = request.POST.get('description')
         product.price = request.POST.get('price')
-        product.stock = request.POST.get('stock')
-        product.save()
+        with transaction.atomic():
+            product.save(update_fields=['name', 'description', 'price'])
+            # Apply the new stock as a change, so units held by carts since
+            # the product was loaded aren't written over
+            adjust_stock(product, int(request.POST.get('stock')) - product.stock, request.user)
         
         # Handle new images
         new_images = request.FILES.getlist('images')
         
-        print(f"\n=== EDIT PRODUCT DEBUG ===")
-        print(f"Files in request: {request.FILES}")
-        print(f"New images: {len(new_images)}")
-        
         if new_images:
             # Get current max order
             max_order_result = product.images.aggregate(models.Max('order'))
@@ -442,17 +590,18 @@ def edit_product(request, product_id):
             if max_order is None:
                 max_order = -1
             
-            print(f"Current max order: {max_order}")
-            
             # Add new images after existing ones
+            saved_images = []
             for index, image in enumerate(new_images):
                 new_order = max_order + index + 1
-                ProductImage.objects.create(
+                saved_images.append(ProductImage.objects.create(
                     product=product,
                     image=image,
                     order=new_order
-                )
-                print(f"✓ Added image {index + 1} with order {new_order}: {image.name}")
+                ))
+            
+            # Resized renditions are generated by the job worker
+            queue_image_renditions(saved_images)
         
         messages.success(request, f'Product updated successfully! Added {len(new_images)} new images.')
         return redirect('seller_dashboard')
@@ -530,11 +679,8 @@ def reorder_product_images(request, product_id):
 
 # Update Order Status
 @login_required(login_url='login')
+@seller_required()
 def update_order_status(request, order_id):
-    if not hasattr(request.user, 'profile') or not request.user.profile.is_seller():
-        messages.error(request, 'Access denied! Sellers only.')
-        return redirect('home')
-    
     if request.method == 'POST':
         order = get_object_or_404(Order, id=order_id)
         
@@ -545,8 +691,15 @@ def update_order_status(request, order_id):
             return redirect('seller_dashboard')
         
         new_status = request.POST.get('status')
-        order.status = new_status
-        order.save()
+        with transaction.atomic():
+            # Re-read under the write lock so a double submit notifies once
+            order.refresh_from_db(fields=['status', 'status_changes'])
+            if order.status != new_status:
+                with SellerStats.track(order):
+                    order.status = new_status
+                    order.status_changes += 1
+                    order.save()
+                queue_order_notification(order)
         
         messages.success(request, f'Order #{order.id} status updated to {order.get_status_display()}!')
         return redirect('seller_dashboard')
@@ -561,7 +714,7 @@ def handle_return_request(request, request_id):
         return_request = get_object_or_404(ReturnRequest, id=request_id)
         
         if not request.user.is_staff:
-            if not hasattr(request.user, 'profile') or not request.user.profile.is_seller():
+            if not is_seller(request.user):
                 messages.error(request, 'Access denied!')
                 return redirect('home')
             
@@ -573,55 +726,75 @@ def handle_return_request(request, request_id):
         action = request.POST.get('action')
         admin_response = request.POST.get('admin_response', '')
         tracking_number = request.POST.get('tracking_number', '')
-        
-        if action == 'approve':
-            return_request.status = 'approved'
-            return_request.admin_response = admin_response
-            return_request.refund_amount = return_request.order.total_price
-            return_request.save()
-            messages.success(request, f'Return request for Order #{return_request.order.id} approved!')
-            
-        elif action == 'reject':
-            return_request.status = 'rejected'
-            return_request.admin_response = admin_response
-            return_request.save()
-            messages.success(request, f'Return request for Order #{return_request.order.id} rejected!')
+        # Re-read under the write lock so a double submit sees the first
+        # one's status: it can't restock twice or notify twice
+        with transaction.atomic():
+            return_request.refresh_from_db(fields=['status', 'status_changes'])
+            previous_status = return_request.status
             
-        elif action == 'item_received':
-            return_request.status = 'item_received'
-            return_request.tracking_number = tracking_number
-            if not return_request.refund_amount:
+            if action == 'approve':
+                return_request.status = 'approved'
+                return_request.admin_response = admin_response
                 return_request.refund_amount = return_request.order.total_price
-            return_request.save()
+                return_request.save()
+                messages.success(request, f'Return request for Order #{return_request.order.id} approved!')
             
-            for item in return_request.order.items.all():
-                item.product.stock += item.quantity
-                item.product.save()
+            elif action == 'reject':
+                return_request.status = 'rejected'
+                return_request.admin_response = admin_response
+                return_request.save()
+                messages.success(request, f'Return request for Order #{return_request.order.id} rejected!')
             
-            messages.success(request, f'Item received for Order #{return_request.order.id}. Stock restored.')
+            elif action == 'item_received':
+                return_request.status = 'item_received'
+                return_request.tracking_number = tracking_number
+                if not return_request.refund_amount:
+                    return_request.refund_amount = return_request.order.total_price
+                return_request.save()
+                if previous_status != 'item_received':
+                    restock_order(return_request.order, 'return')
             
-        elif action == 'initiate_refund':
-            if not return_request.refund_amount:
-                return_request.refund_amount = return_request.order.total_price
-            return_request.status = 'refund_processing'
-            return_request.save()
-            messages.success(request, f'Refund initiated for Order #{return_request.order.id}. Amount: ₹{return_request.refund_amount}')
+                messages.success(request, f'Item received for Order #{return_request.order.id}. Stock restored.')
             
-        elif action == 'complete_refund':
-            from django.utils import timezone
-            refund_method = request.POST.get('refund_method', 'Original Payment Method')
+            elif action == 'initiate_refund':
+                if not return_request.refund_amount:
+                    return_request.refund_amount = return_request.order.total_price
+                return_request.status = 'refund_processing'
+                return_request.save()
+                messages.success(request, f'Refund initiated for Order #{return_request.order.id}. Amount: ₹{return_request.refund_amount}')
             
-            if not return_request.refund_amount:
-                return_request.refund_amount = return_request.order.total_price
+            elif action == 'complete_refund':
+                from django.utils import timezone
+                refund_method = request.POST.get('refund_method', 'Original Payment Method')
             
-            return_request.status = 'refund_completed'
-            return_request.refund_date = timezone.now()
-            return_request.refund_method = refund_method
-            return_request.save()
+                if not return_request.refund_amount:
+                    return_request.refund_amount = return_request.order.total_price
             
-            messages.success(request, f'Refund completed for Order #{return_request.order.id}!')
+                with SellerStats.track(return_request.order):
+                    return_request.status = 'refund_completed'
+                    return_request.refund_date = timezone.now()
+                    return_request.refund_method = refund_method
+                    return_request.save()
+            
+                messages.success(request, f'Refund completed for Order #{return_request.order.id}!')
+            
+            if return_request.status != previous_status:
+                return_request.status_changes += 1
+                return_request.save(update_fields=['status_changes'])
+                queue_return_notification(return_request)
         
         return redirect('seller_dashboard')
     
     return redirect('seller_dashboard')
 
+
+
+# Prometheus metrics (staff, or a scraper presenting METRICS_TOKEN)
+def metrics(request):
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    scraper = bool(token) and constant_time_compare(authorization, f'Bearer {token}')
+    if not (scraper or request.user.is_staff):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')